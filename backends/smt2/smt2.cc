@@ -23,11 +23,34 @@
 #include "kernel/celltypes.h"
 #include "kernel/log.h"
 #include "kernel/mem.h"
+#include "libs/sha1/sha1.h"
 #include <string>
 
 USING_YOSYS_NAMESPACE
 PRIVATE_NAMESPACE_BEGIN
 
+static std::string json_string(std::string str)
+{
+	std::string newstr = "\"";
+	for (char c : str) {
+		if (c == '\\')
+			newstr += "\\\\";
+		else if (c == '"')
+			newstr += "\\\"";
+		else if (c == '\n')
+			newstr += "\\n";
+		else if (c == '\t')
+			newstr += "\\t";
+		// identifiers aren't necessarily UTF-8, so every byte outside
+		// of ASCII becomes a code point of its own
+		else if ((unsigned char)c < 0x20 || (unsigned char)c >= 0x80)
+			newstr += stringf("\\u%04X", (unsigned char)c);
+		else
+			newstr += c;
+	}
+	return newstr + "\"";
+}
+
 struct Smt2Worker
 {
 	CellTypes ct;
@@ -53,6 +76,9 @@ struct Smt2Worker
 	std::map<int, int> bvsizes;
 	dict<IdString, char*> ids;
 
+	// metadata for the -meta sidecar, JSON members per category
+	std::map<std::string, std::vector<std::string>> meta;
+
 	const char *get_id(IdString n)
 	{
 		if (ids.count(n) == 0) {
@@ -584,12 +610,16 @@ struct Smt2Worker
 				if (cell->attributes.count(ID::reg))
 					infostr += " " + cell->attributes.at(ID::reg).decode_string();
 				decls.push_back(stringf("; yosys-smt2-%s %s#%d %d %s\n", cell->type.c_str() + 1, get_id(module), idcounter, GetSize(cell->getPort(ID::Y)), infostr.c_str()));
+				meta[stringf("%ss", cell->type.c_str() + 1)].push_back(stringf("%s: [%d, %s]", json_string(stringf("%s#%d", get_id(module), idcounter)).c_str(),
+						GetSize(cell->getPort(ID::Y)), json_string(infostr).c_str()));
 				if (cell->getPort(ID::Y).is_wire() && cell->getPort(ID::Y).as_wire()->get_bool_attribute(ID::maximize)){
 					decls.push_back(stringf("; yosys-smt2-maximize %s#%d\n", get_id(module), idcounter));
+					meta["maximize"].push_back(json_string(stringf("%s#%d", get_id(module), idcounter)));
 					log("Wire %s is maximized\n", cell->getPort(ID::Y).as_wire()->name.str().c_str());
 				}
 				else if (cell->getPort(ID::Y).is_wire() && cell->getPort(ID::Y).as_wire()->get_bool_attribute(ID::minimize)){
 					decls.push_back(stringf("; yosys-smt2-minimize %s#%d\n", get_id(module), idcounter));
+					meta["minimize"].push_back(json_string(stringf("%s#%d", get_id(module), idcounter)));
 					log("Wire %s is minimized\n", cell->getPort(ID::Y).as_wire()->name.str().c_str());
 				}
 				makebits(stringf("%s#%d", get_id(module), idcounter), GetSize(cell->getPort(ID::Y)), log_signal(cell->getPort(ID::Y)));
@@ -721,6 +751,8 @@ struct Smt2Worker
 				log_error("Memory %s.%s has mixed clocked/nonclocked write ports. This is not supported by \"write_smt2\".\n", log_id(cell), log_id(module));
 
 			decls.push_back(stringf("; yosys-smt2-memory %s %d %d %d %d %s\n", get_id(mem->memid), abits, mem->width, GetSize(mem->rd_ports), GetSize(mem->wr_ports), has_async_wr ? "async" : "sync"));
+			meta["memories"].push_back(stringf("%s: [%d, %d, %d, %d, \"%s\"]", json_string(get_id(mem->memid)).c_str(), abits, mem->width,
+					GetSize(mem->rd_ports), GetSize(mem->wr_ports), has_async_wr ? "async" : "sync"));
 
 			string memstate;
 			if (has_async_wr) {
@@ -813,6 +845,7 @@ struct Smt2Worker
 		if (m != nullptr)
 		{
 			decls.push_back(stringf("; yosys-smt2-cell %s %s\n", get_id(cell->type), get_id(cell->name)));
+			meta["cells"].push_back(stringf("%s: %s", json_string(get_id(cell->name)).c_str(), json_string(get_id(cell->type)).c_str()));
 			string cell_state = stringf("(|%s_h %s| state)", get_id(module), get_id(cell->name));
 
 			for (auto &conn : cell->connections())
@@ -892,17 +925,30 @@ struct Smt2Worker
 			if (wire->port_id || is_register || wire->get_bool_attribute(ID::keep) || (wiresmode && wire->name.isPublic())) {
 				RTLIL::SigSpec sig = sigmap(wire);
 				std::vector<std::string> comments;
-				if (wire->port_input)
+				std::string wire_meta = stringf("%s: %d", json_string(get_id(wire)).c_str(), wire->width);
+				if (wire->port_input) {
 					comments.push_back(stringf("; yosys-smt2-input %s %d\n", get_id(wire), wire->width));
-				if (wire->port_output)
+					meta["inputs"].push_back(wire_meta);
+				}
+				if (wire->port_output) {
 					comments.push_back(stringf("; yosys-smt2-output %s %d\n", get_id(wire), wire->width));
-				if (is_register)
+					meta["outputs"].push_back(wire_meta);
+				}
+				if (is_register) {
 					comments.push_back(stringf("; yosys-smt2-register %s %d\n", get_id(wire), wire->width));
-				if (wire->get_bool_attribute(ID::keep) || (wiresmode && wire->name.isPublic()))
+					meta["registers"].push_back(wire_meta);
+				}
+				if (wire->get_bool_attribute(ID::keep) || (wiresmode && wire->name.isPublic())) {
 					comments.push_back(stringf("; yosys-smt2-wire %s %d\n", get_id(wire), wire->width));
-				if (GetSize(wire) == 1 && (clock_posedge.count(sig) || clock_negedge.count(sig)))
+					meta["wires"].push_back(wire_meta);
+				}
+				if (GetSize(wire) == 1 && (clock_posedge.count(sig) || clock_negedge.count(sig))) {
 					comments.push_back(stringf("; yosys-smt2-clock %s%s%s\n", get_id(wire),
 							clock_posedge.count(sig) ? " posedge" : "", clock_negedge.count(sig) ? " negedge" : ""));
+					meta["clocks"].push_back(stringf("%s: [%s]", json_string(get_id(wire)).c_str(),
+							clock_posedge.count(sig) && clock_negedge.count(sig) ? "\"posedge\", \"negedge\"" :
+							clock_posedge.count(sig) ? "\"posedge\"" : "\"negedge\""));
+				}
 				if (bvmode && GetSize(sig) > 1) {
 					std::string sig_bv = get_bv(sig);
 					if (!comments.empty())
@@ -985,10 +1031,14 @@ struct Smt2Worker
 
 				string name_a = get_bool(cell->getPort(ID::A));
 				string name_en = get_bool(cell->getPort(ID::EN));
-				if (cell->name[0] == '$' && cell->attributes.count(ID::src))
+				if (cell->name[0] == '$' && cell->attributes.count(ID::src)) {
 					decls.push_back(stringf("; yosys-smt2-%s %d %s %s\n", cell->type.c_str() + 1, id, get_id(cell), cell->attributes.at(ID::src).decode_string().c_str()));
-				else
+					meta[stringf("%ss", cell->type.c_str() + 1)].push_back(stringf("\"%d\": [%s, %s]", id, json_string(get_id(cell)).c_str(),
+							json_string(cell->attributes.at(ID::src).decode_string()).c_str()));
+				} else {
 					decls.push_back(stringf("; yosys-smt2-%s %d %s\n", cell->type.c_str() + 1, id, get_id(cell)));
+					meta[stringf("%ss", cell->type.c_str() + 1)].push_back(stringf("\"%d\": [%s]", id, json_string(get_id(cell)).c_str()));
+				}
 
 				if (cell->type == ID($cover))
 					decls.push_back(stringf("(define-fun |%s_%c %d| ((state |%s_s|)) Bool (and %s %s)) ; %s\n",
@@ -1362,6 +1412,19 @@ struct Smt2Worker
 			f << "true)";
 		f << stringf(" ; end of module %s\n", get_id(module));
 	}
+
+	void write_meta(std::ostream &f)
+	{
+		f << stringf("    {\n      \"name\": %s", json_string(get_id(module)).c_str());
+		for (auto &it : meta) {
+			bool is_list = it.first == "maximize" || it.first == "minimize";
+			f << stringf(",\n      \"%s\": %c", it.first.c_str(), is_list ? '[' : '{');
+			for (int i = 0; i < GetSize(it.second); i++)
+				f << (i ? ", " : "") << it.second[i];
+			f << (is_list ? ']' : '}');
+		}
+		f << "\n    }";
+	}
 };
 
 struct Smt2Backend : public Backend {
@@ -1477,6 +1540,12 @@ struct Smt2Backend : public Backend {
 		log("        emit a `; yosys-smt2-solver-option` directive for yosys-smtbmc to write\n");
 		log("        the given option as a `(set-option ...)` command in the SMT-LIBv2.\n");
 		log("\n");
+		log("    -meta <filename>\n");
+		log("        also write the metadata from the `; yosys-smt2-*` comments to the given\n");
+		log("        JSON file. yosys-smtbmc can read it with --meta instead of parsing the\n");
+		log("        comments. the JSON file records the size and SHA1 hash of the SMT-LIBv2\n");
+		log("        output, so that yosys-smtbmc can check that both belong together.\n");
+		log("\n");
 		log("[1] For more information on SMT-LIBv2 visit http://smt-lib.org/ or read David\n");
 		log("R. Cok's tutorial: https://smtlib.github.io/jSMTLIB/SMTLIBTutorial.pdf\n");
 		log("\n");
@@ -1529,6 +1598,7 @@ struct Smt2Backend : public Backend {
 	void execute(std::ostream *&f, std::string filename, std::vector<std::string> args, RTLIL::Design *design) override
 	{
 		std::ifstream template_f;
+		std::ofstream meta_f;
 		bool bvmode = true, memmode = true, wiresmode = false, verbose = false, statebv = false, statedt = false;
 		bool forallmode = false;
 		dict<std::string, std::string> solver_options;
@@ -1580,6 +1650,12 @@ struct Smt2Backend : public Backend {
 				verbose = true;
 				continue;
 			}
+			if (args[argidx] == "-meta" && argidx+1 < args.size()) {
+				meta_f.open(args[++argidx]);
+				if (meta_f.fail())
+					log_error("Can't open metadata file `%s' for writing.\n", args[argidx].c_str());
+				continue;
+			}
 			if (args[argidx] == "-solver-option" && argidx+2 < args.size()) {
 				solver_options.emplace(args[argidx+1], args[argidx+2]);
 				argidx += 2;
@@ -1589,6 +1665,13 @@ struct Smt2Backend : public Backend {
 		}
 		extra_args(f, filename, args, argidx);
 
+		// with -meta the output is collected first, so that its size and
+		// hash can go into the metadata. f is restored before returning.
+		std::ostream *smt2_f = f;
+		std::stringstream smt2_buf;
+		if (meta_f.is_open())
+			f = &smt2_buf;
+
 		if (template_f.is_open()) {
 			std::string line;
 			while (std::getline(template_f, line)) {
@@ -1664,6 +1747,32 @@ struct Smt2Backend : public Backend {
 				log_error("Forall-exists problems are only supported in -stbv or -stdt mode.\n");
 		}
 
+		if (meta_f.is_open()) {
+			meta_f << stringf("{\n  \"generator\": %s,\n  \"version\": 2,\n", json_string(yosys_version_str).c_str());
+			std::vector<std::string> flags;
+			if (!bvmode)
+				flags.push_back("nobv");
+			if (!memmode)
+				flags.push_back("nomem");
+			if (statebv)
+				flags.push_back("stbv");
+			if (statedt)
+				flags.push_back("stdt");
+			if (forallmode)
+				flags.push_back("forall");
+			meta_f << "  \"flags\": [";
+			for (int i = 0; i < GetSize(flags); i++)
+				meta_f << (i ? ", " : "") << json_string(flags[i]);
+			meta_f << "],\n  \"solver_options\": {";
+			bool first = true;
+			for (auto &it : solver_options) {
+				meta_f << (first ? "" : ", ") << json_string(it.first) << ": " << json_string(it.second);
+				first = false;
+			}
+			meta_f << "},\n  \"modules\": [";
+		}
+
+		bool first_module = true;
 		for (auto module : sorted_modules)
 		{
 			if (module->get_blackbox_attribute() || module->has_processes_warn())
@@ -1675,10 +1784,21 @@ struct Smt2Backend : public Backend {
 			worker.run();
 			worker.write(*f);
 
+			if (meta_f.is_open()) {
+				meta_f << (first_module ? "\n" : ",\n");
+				worker.write_meta(meta_f);
+				first_module = false;
+			}
+
 			if (module == topmod)
 				topmod_id = worker.get_id(module);
 		}
 
+		if (meta_f.is_open()) {
+			meta_f << "\n  ],\n";
+			meta_f << stringf("  \"topmod\": %s,\n", topmod ? json_string(topmod_id).c_str() : "null");
+		}
+
 		if (topmod)
 			*f << stringf("; yosys-smt2-topmod %s\n", topmod_id.c_str());
 
@@ -1689,6 +1809,14 @@ struct Smt2Backend : public Backend {
 			while (std::getline(template_f, line))
 				*f << line << std::endl;
 		}
+
+		if (meta_f.is_open()) {
+			std::string smt2_text = smt2_buf.str();
+			f = smt2_f;
+			*f << smt2_text;
+			meta_f << stringf("  \"smt2\": {\"size\": %zu, \"sha1\": \"%s\"}\n}\n", smt2_text.size(), sha1(smt2_text).c_str());
+			meta_f.close();
+		}
 	}
 } Smt2Backend;
 
@@ -17,10 +17,11 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
-import os, sys, getopt, re
+import os, sys, getopt, re, json, asyncio, signal
 ##yosys-sys-path##
-from smtio import SmtIo, SmtOpts, MkVcd
+from smtio import SmtIo, AsyncSmtIo, SmtOpts, MkVcd
 from collections import defaultdict
+from threading import Thread
 
 got_topt = False
 skip_steps = 0
@@ -51,6 +52,12 @@ smtctop = None
 noinit = False
 binarymode = False
 keep_going = False
+statsfile = None
+metafile = None
+jobs = 1
+kind = False
+kind_depth = None
+check_assuming = False
 so = SmtOpts()
 
 
@@ -161,6 +168,56 @@ def usage():
         covering all found failed assertions, the character '%' is
         replaced in all dump filenames with an increasing number.
 
+    --check-assuming
+        guard the negated assertions (and the cover statements with -c)
+        of each check with a fresh activation literal and use
+        (check-sat-assuming) instead of (push) and (pop), so that the
+        solver keeps what it learned between the checks. this includes
+        the --jobs and --kind solvers. the main solver doesn't use it
+        with --append or for exists-forall problems.
+
+    --stats-json <filename>
+        write timing and I/O statistics for every solver check, query
+        and burst of writes, with totals per step, to the given file
+        in JSON format.
+
+    --meta <filename>
+        read the design metadata from the JSON file written by
+        "write_smt2 -meta" instead of the comments in the smt2 file.
+        both files must come from the same write_smt2 call, this is
+        checked with the size and hash of the smt2 file recorded in the
+        JSON file.
+
+    --jobs <N>
+        run the BMC checks on N additional solvers at once. each of
+        them adds the steps up to the check it works on and assumes
+        the assertions in all earlier steps. the first failing check
+        is then repeated on the main solver, which writes the trace.
+        when a trace is written (--dump-vcd, --dump-vlogtb or
+        --dump-smtc), the main solver repeats all checks before the
+        failing one, so that the trace is the same as without --jobs.
+        a failing run then takes as long as without --jobs, only the
+        failing step is known earlier.
+        with -i, induction is tried with the depths 1, 2, 4, .. and
+        the -t depth at once, and the smallest successful one is
+        reported. with -c, the cover statements are split between the
+        solvers and the main solver only repeats the checks that reach
+        a cover statement.
+        with --keep-going, the assertions are split between N solvers
+        after the first failure, which check their share of each step
+        at the same time. each model they find gets its own trace.
+        these traces show the same failing assertions as without
+        --jobs, but they can come from different models.
+        --jobs can't be used with -g or --final-only.
+
+    --kind
+        run the BMC checks and the induction loop of -i at the same
+        time on two additional solvers (or --jobs solvers for BMC).
+        stops with PASSED when induction succeeds with k steps and BMC
+        has passed the first k steps after <skip_steps>, or with FAILED
+        when BMC finds a counterexample or induction fails with all k
+        up to the number of steps checked by BMC.
+
 """ + so.helpmsg())
     sys.exit(1)
 
@@ -169,7 +226,7 @@ try:
     opts, args = getopt.getopt(sys.argv[1:], so.shortopts + "t:igcm:", so.longopts +
             ["final-only", "assume-skipped=", "smtc=", "cex=", "aig=", "aig-noheader", "btorwit=", "presat",
              "dump-vcd=", "dump-vlogtb=", "vlogtb-top=", "dump-smtc=", "dump-all", "noinfo", "append=",
-             "smtc-init", "smtc-top=", "noinit", "binary", "keep-going"])
+             "smtc-init", "smtc-top=", "noinit", "binary", "keep-going", "stats-json=", "meta=", "jobs=", "kind", "check-assuming"])
 except:
     usage()
 
@@ -244,6 +301,16 @@ for o, a in opts:
         binarymode = True
     elif o == "--keep-going":
         keep_going = True
+    elif o == "--stats-json":
+        statsfile = a
+    elif o == "--meta":
+        metafile = a
+    elif o == "--jobs":
+        jobs = int(a)
+    elif o == "--kind":
+        kind = True
+    elif o == "--check-assuming":
+        check_assuming = True
     elif so.handle(o, a):
         pass
     else:
@@ -252,9 +319,22 @@ for o, a in opts:
 if len(args) != 1:
     usage()
 
-if sum([tempind, gentrace, covermode]) > 1:
+if sum([tempind, gentrace, covermode, kind]) > 1:
+    usage()
+
+if kind and final_only:
+    usage()
+
+if jobs < 1:
+    usage()
+
+if jobs > 1 and (gentrace or final_only):
     usage()
 
+if (jobs > 1 or kind) and (so.solver == "dummy" or so.solver.startswith("portfolio:") or so.noincr or so.warm_pool_size != 0 or so.cache_dir is not None):
+    print("--jobs and --kind can't be used with the dummy solver, portfolio mode, --noincr, --warm-pool or --cache.")
+    sys.exit(1)
+
 constr_final_start = None
 constr_asserts = defaultdict(list)
 constr_assumes = defaultdict(list)
@@ -402,6 +482,9 @@ def get_constr_expr(db, state, final=False, getvalues=False, individual=False):
 
 smt = SmtIo(opts=so)
 
+if statsfile is not None:
+    smt.stats = list()
+
 if noinfo and vcdfile is None and vlogtbfile is None and outconstr is None:
     smt.produce_models = False
 
@@ -411,9 +494,9 @@ def print_msg(msg):
 
 print_msg("Solver: %s" % (so.solver))
 
-with open(args[0], "r") as f:
-    for line in f:
-        smt.write(line)
+if metafile is not None:
+    smt.load_meta(metafile, args[0])
+smt.load(args[0], info=metafile is None)
 
 for line in constr_write:
     smt.write(line)
@@ -744,7 +827,7 @@ def write_vcd_trace(steps_start, steps_stop, index):
             wdata = list()
             addrs = set()
 
-            for eid, edat in zip(expr_id, smt.get_list(expr_list)):
+            for eid, edat in zip(expr_id, smt.bv2bin_list(smt.get_list(expr_list))):
                 t, i, j, f = eid
 
                 if t == 'R':
@@ -762,7 +845,7 @@ def write_vcd_trace(steps_start, steps_stop, index):
                     c.append(dict())
                 c = c[j]
 
-                c[f] = smt.bv2bin(edat)
+                c[f] = edat
 
                 if f == 'A':
                     addrs.add(c[f])
@@ -825,8 +908,7 @@ def write_vcd_trace(steps_start, steps_stop, index):
         for i in range(steps_start, steps_stop):
             vcd.set_time(i)
             value_list = smt.get_net_bin_list(topmod, path_list, "s%d" % i)
-            for path, value in zip(path_list, value_list):
-                vcd.set_net([topmod] + path, value)
+            vcd.set_net_list([[topmod] + path for path in path_list], value_list)
             if i in mem_trace_data:
                 for path, value in mem_trace_data[i]:
                     vcd.set_net([topmod] + path, value)
@@ -947,13 +1029,11 @@ def write_vlogtb_trace(steps_start, steps_stop, index):
                     addr_expr_list.append(smt.mem_expr(vlogtb_topmod, vlogtb_state.replace("@@step_idx@@", str(i)), mempath, "R%dA" % j))
                     data_expr_list.append(smt.mem_expr(vlogtb_topmod, vlogtb_state.replace("@@step_idx@@", str(i)), mempath, "R%dD" % j))
 
-            addr_list = smt.get_list(addr_expr_list)
-            data_list = smt.get_list(data_expr_list)
+            addr_list = smt.bv2bin_list(smt.get_list(addr_expr_list))
+            data_list = smt.bv2bin_list(smt.get_list(data_expr_list))
 
             addr_data = dict()
             for addr, data in zip(addr_list, data_list):
-                addr = smt.bv2bin(addr)
-                data = smt.bv2bin(data)
                 if addr not in addr_data:
                     addr_data[addr] = data
 
@@ -1178,9 +1258,23 @@ def get_assert_map(mod, base, path, key_base=()):
     return assert_map
 
 
+assert_templates = None
+
+def get_assert_templates():
+    # the assert map of the top module, built once, with each expression
+    # split into the parts before and after the state
+    global assert_templates
+    if assert_templates is None:
+        assert_templates = list()
+        for key, (expr, path, desc) in get_assert_map(topmod, "\0", topmod).items():
+            prefix, suffix = expr.split("\0")
+            assert_templates.append((key, prefix, suffix, path, desc))
+    return assert_templates
+
+
 def get_assert_keys():
     keys = set()
-    keys.update(get_assert_map(topmod, 'state', topmod).keys())
+    keys.update(key for key, prefix, suffix, path, desc in get_assert_templates())
     for step_constr_asserts in constr_asserts.values():
         keys.update(loc for loc, expr in step_constr_asserts)
 
@@ -1189,9 +1283,10 @@ def get_assert_keys():
 
 def get_active_assert_map(step, active):
     assert_map = dict()
-    for key, assert_data in get_assert_map(topmod, "s%s" % step, topmod).items():
+    state = "s%s" % step
+    for key, prefix, suffix, path, desc in get_assert_templates():
         if key in active:
-            assert_map[key] = assert_data
+            assert_map[key] = (prefix + state + suffix, path, desc)
 
     for loc, expr, actual_expr in zip(*get_constr_expr(constr_asserts, step, individual=True)):
         if loc in active:
@@ -1235,6 +1330,57 @@ def smt_assert_consequent(expr):
     asserts_cache_dirty = True
     asserts_consequent_cache[-1].append(expr)
 
+def bmc_step_asserts(step):
+    # the assertions that add state s<step> to the BMC and cover loops,
+    # as (kind, expr) pairs for smt_assert_step() and job_assert_step()
+    asserts = [
+        ("consequent", "(|%s_u| s%d)" % (topmod, step)),
+        ("antecedent", "(|%s_h| s%d)" % (topmod, step)),
+        ("consequent", get_constr_expr(constr_assumes, step)),
+    ]
+
+    if step == 0:
+        if noinit:
+            asserts.append(("antecedent", "(not (|%s_is| s%d))" % (topmod, step)))
+        else:
+            asserts.append(("antecedent", "(|%s_i| s0)" % (topmod)))
+            asserts.append(("antecedent", "(|%s_is| s0)" % (topmod)))
+
+    else:
+        asserts.append(("antecedent", "(|%s_t| s%d s%d)" % (topmod, step-1, step)))
+        asserts.append(("antecedent", "(not (|%s_is| s%d))" % (topmod, step)))
+
+    return asserts
+
+def induction_step_asserts(step):
+    # the same for the induction loop, which goes back from num_steps
+    asserts = [
+        ("consequent", "(|%s_u| s%d)" % (topmod, step)),
+        ("antecedent", "(|%s_h| s%d)" % (topmod, step)),
+        ("antecedent", "(not (|%s_is| s%d))" % (topmod, step)),
+        ("consequent", get_constr_expr(constr_assumes, step)),
+    ]
+
+    if step == num_steps:
+        asserts.append((None, "(not (and (|%s_a| s%d) %s))" % (topmod, step, get_constr_expr(constr_asserts, step))))
+
+    else:
+        asserts.append(("antecedent", "(|%s_t| s%d s%d)" % (topmod, step, step+1)))
+        asserts.append((None, "(|%s_a| s%d)" % (topmod, step)))
+        asserts.append((None, get_constr_expr(constr_asserts, step)))
+
+    return asserts
+
+def smt_assert_step(step, asserts):
+    smt_state(step)
+    for kind, expr in asserts:
+        if kind == "antecedent":
+            smt_assert_antecedent(expr)
+        elif kind == "consequent":
+            smt_assert_consequent(expr)
+        else:
+            smt_assert(expr)
+
 def smt_forall_assert():
     if not smt.forall:
         return
@@ -1348,37 +1494,512 @@ def smt_pop():
     asserts_consequent_cache.pop()
     smt.write("(pop 1)")
 
+query_lits = list()
+query_count = 0
+
+def smt_query_assuming():
+    # appended steps have to be removed again with (pop)
+    return check_assuming and append_steps == 0 and not smt.forall
+
+def smt_query_start():
+    # a check with temporary assertions, either in a (push) or guarded
+    # by a new activation literal for --check-assuming
+    global query_count
+    if not smt_query_assuming():
+        smt_push()
+        query_lits.append(None)
+        return
+
+    query_lits.append("act%d" % query_count)
+    query_count += 1
+    smt.write("(declare-fun %s () Bool)" % query_lits[-1])
+
+def smt_query_assert(expr, consequent=False):
+    if query_lits[-1] is None:
+        if consequent:
+            smt_assert_consequent(expr)
+        else:
+            smt_assert(expr)
+    elif expr != "true":
+        smt.write("(assert (=> %s %s))" % (query_lits[-1], expr))
+
+def smt_query_end():
+    lit = query_lits.pop()
+    if lit is None:
+        smt_pop()
+    else:
+        smt.write("(assert (not %s))" % lit)
+
 def smt_check_sat(expected=["sat", "unsat"]):
     if asserts_cache_dirty:
         smt_forall_assert()
-    return smt.check_sat(expected=expected)
+    return smt.check_sat(expected=expected, assume=[lit for lit in query_lits if lit is not None])
+
+def job_solver(models=False):
+    # another solver with the same design, for --jobs
+    solver = AsyncSmtIo(opts=so)
+    solver.produce_models = models
+    solver.debug_file = None
+    solver.dummy_file = None
+    if metafile is not None:
+        solver.load_meta(metafile, args[0])
+    solver.load(args[0], info=metafile is None)
+    for line in constr_write:
+        solver.write(line)
+    solver.query_count = 0
+    return solver
+
+def job_assert(solver, expr):
+    if expr != "true":
+        solver.write("(assert %s)" % expr)
+
+def job_query_start(solver):
+    # same as smt_query_start(), for a --jobs solver, returns the
+    # activation literal (or None) for the other job_query functions
+    if not check_assuming:
+        solver.write("(push 1)")
+        return None
+
+    lit = "act%d" % solver.query_count
+    solver.query_count += 1
+    solver.write("(declare-fun %s () Bool)" % lit)
+    return lit
+
+def job_query_assert(solver, lit, expr):
+    if lit is None:
+        solver.write("(assert %s)" % expr)
+    else:
+        solver.write("(assert (=> %s %s))" % (lit, expr))
+
+async def job_query_check(solver, lit):
+    return await solver.check_sat(["sat", "unsat"], assume=None if lit is None else [lit])
+
+def job_query_end(solver, lit):
+    if lit is None:
+        solver.write("(pop 1)")
+    else:
+        solver.write("(assert (not %s))" % lit)
+
+async def job_kill(solvers):
+    for solver in solvers:
+        await solver.p_kill_wait(signal.SIGKILL)
+
+def job_assert_step(solver, step, asserts):
+    # same as smt_assert_step(), for a --jobs or --kind solver
+    solver.write("(declare-fun s%d () |%s_s|)" % (step, topmod))
+    for kind, expr in asserts:
+        job_assert(solver, expr)
+
+def bmc_parallel(active_assert_keys):
+    # Runs the (--presat and) assertion checks of the BMC loop on the
+    # --jobs solvers. Checks are handed out in order of their first step.
+    # Returns the first step of the earliest failing check, or num_steps,
+    # once all checks before it have passed. With --kind the induction
+    # loop runs on one more solver and a successful induction with k
+    # steps sets kind_depth and ends the search once the first k checked
+    # steps have passed.
+    global kind_depth
+    checks = list(range(skip_steps, num_steps, step_size))
+    passed = [False] * len(checks)
+    first_failed = len(checks)
+    next_check = 0
+    induction_done = not kind
+
+    print_msg("Starting %d solvers for parallel BMC.." % jobs)
+    solvers = [job_solver() for i in range(jobs)]
+    if kind:
+        print_msg("Starting solver for induction..")
+        induction_solver = job_solver()
+
+    def check_done():
+        if kind_depth is not None and all(passed[i] for i in range(len(checks)) if checks[i] < skip_steps + kind_depth):
+            done.set()
+        elif all(passed[:first_failed]) and (first_failed < len(checks) or induction_done):
+            done.set()
+
+    async def job(jobidx, solver):
+        nonlocal first_failed, next_check
+        step = 0
+        while next_check < first_failed:
+            idx = next_check
+            next_check += 1
+            start = checks[idx]
+            stop = min(start + step_size, num_steps)
+
+            while step < stop:
+                job_assert_step(solver, step, bmc_step_asserts(step))
+                if step < start and (step >= skip_steps or (assume_skipped is not None and step >= assume_skipped)):
+                    job_assert(solver, "(|%s_a| s%d)" % (topmod, step))
+                    job_assert(solver, get_constr_expr(constr_asserts, step))
+                step += 1
+
+            if stop == start + 1:
+                print_msg("Checking assertions in step %d (job %d).." % (start, jobidx))
+            else:
+                print_msg("Checking assertions in steps %d to %d (job %d).." % (start, stop-1, jobidx))
+
+            failed = presat and await solver.check_sat(["sat", "unsat"]) == "unsat"
+            if not failed:
+                assert_exprs = list()
+                for i in range(start, stop):
+                    assert_exprs.extend(assert_data[0] for assert_data in get_active_assert_map(i, active_assert_keys).values())
+                lit = job_query_start(solver)
+                if len(assert_exprs) == 0:
+                    job_query_assert(solver, lit, "false")
+                elif len(assert_exprs) == 1:
+                    job_query_assert(solver, lit, "(not %s)" % assert_exprs[0])
+                else:
+                    job_query_assert(solver, lit, "(not (and %s))" % " ".join(assert_exprs))
+                failed = await job_query_check(solver, lit) == "sat"
+                job_query_end(solver, lit)
+
+            if failed:
+                first_failed = min(first_failed, idx)
+            else:
+                passed[idx] = True
+                for i in range(start, stop):
+                    job_assert(solver, "(|%s_a| s%d)" % (topmod, i))
+                    job_assert(solver, get_constr_expr(constr_asserts, i))
+
+            check_done()
+
+    async def induction(solver):
+        # same as the -i loop, without traces
+        global kind_depth
+        nonlocal induction_done
+        skip_counter = step_size
+        for step in range(num_steps, -1, -1):
+            # the initial state is never part of the induction, so BMC
+            # has to check at least step 0. induction with more steps than
+            # BMC checks after skip_steps can't be used for the proof.
+            if max(num_steps - step, 1) > num_steps - skip_steps:
+                print_msg("Not trying induction with more than the %d steps checked by BMC." % (num_steps - skip_steps))
+                break
+
+            job_assert_step(solver, step, induction_step_asserts(step))
+
+            skip_counter += 1
+            if skip_counter < step_size:
+                continue
+            skip_counter = 0
+
+            print_msg("Trying induction in step %d.." % (step))
+            if await solver.check_sat(["sat", "unsat"]) == "unsat":
+                kind_depth = max(num_steps - step, 1)
+                print_msg("Temporal induction successful in step %d." % (step))
+                break
+
+        if kind_depth is None:
+            print_msg("Temporal induction failed!")
+        induction_done = True
+        check_done()
+
+    async def run():
+        nonlocal done
+        done = asyncio.Event()
+        tasks = [asyncio.ensure_future(job(i, solver)) for i, solver in enumerate(solvers)]
+        if kind:
+            tasks.append(asyncio.ensure_future(induction(induction_solver)))
+        await done.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await job_kill(solvers + [induction_solver] if kind else solvers)
+
+    done = None
+    if len(checks) != 0 or kind:
+        asyncio.run(run())
+
+    if kind_depth is not None and all(passed[i] for i in range(len(checks)) if checks[i] < skip_steps + kind_depth):
+        print_msg("BMC passed for the first %d checked steps on the parallel solvers." % kind_depth)
+        return skip_steps + kind_depth
+    if first_failed == len(checks):
+        print_msg("All assertion checks passed on the parallel solvers.")
+        return num_steps
+    print_msg("Earliest failing check on the parallel solvers is in step %d." % checks[first_failed])
+    return checks[first_failed]
+
+def induction_parallel():
+    # Tries induction with the depths 1, 2, 4, .. and num_steps at once
+    # on the --jobs solvers, smallest depths first. Each solver extends
+    # its unrolling from one depth to the next. Induction with depth k
+    # also holds with depth k+1, so attempts with larger depths than a
+    # successful one are cancelled. Returns the smallest successful
+    # depth, or None if induction fails with depth num_steps.
+    depths = [1 << i for i in range(num_steps.bit_length())] + [num_steps]
+    depths = sorted(set(k for k in depths if k >= skip_steps))
+    result = [None] * len(depths)
+    working = [None] * jobs
+    next_depth = 0
+
+    print_msg("Starting %d solvers for parallel induction.." % jobs)
+    solvers = [job_solver() for i in range(jobs)]
+
+    def check_done():
+        for r in result:
+            if r is None:
+                return
+            if r:
+                break
+        done.set()
+
+    async def job(jobidx, solver):
+        nonlocal next_depth
+        step = num_steps + 1
+        while next_depth < len(depths) and True not in result[:next_depth]:
+            idx = next_depth
+            next_depth += 1
+            working[jobidx] = idx
+
+            while step > num_steps - depths[idx]:
+                step -= 1
+                job_assert_step(solver, step, induction_step_asserts(step))
+
+            print_msg("Trying induction with depth %d (job %d).." % (depths[idx], jobidx))
+            result[idx] = await solver.check_sat(["sat", "unsat"]) == "unsat"
+
+            if result[idx]:
+                print_msg("Temporal induction successful with depth %d (job %d)." % (depths[idx], jobidx))
+                for i, task in enumerate(tasks):
+                    if working[i] is not None and working[i] > idx:
+                        task.cancel()
+                        await job_kill([solvers[i]])
+            check_done()
+        working[jobidx] = None
+
+    async def run():
+        nonlocal done, tasks
+        done = asyncio.Event()
+        tasks = [asyncio.ensure_future(job(i, solver)) for i, solver in enumerate(solvers)]
+        await done.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await job_kill(solvers)
+
+    done = None
+    tasks = None
+    if len(depths) != 0:
+        asyncio.run(run())
+
+    if True in result:
+        return depths[result.index(True)]
+    return None
+
+def cover_parallel(cover_expr, cover_desc):
+    # Finds the first step in which each cover statement is reached on
+    # the --jobs solvers, each of them working on every N-th cover. The
+    # models of all solvers are checked against all covers, so a cover
+    # reached in another solver's model doesn't need its own check in
+    # that step. Returns the steps, with None for unreached covers.
+    reached = [None] * len(cover_desc)
+    first_reached = [None] * len(cover_desc)
+
+    print_msg("Starting %d solvers for parallel cover checks.." % jobs)
+    solvers = [job_solver(models=True) for i in range(jobs)]
+
+    async def job(jobidx, solver):
+        solver.write("(define-fun covers_0 ((state |%s_s|)) (_ BitVec %d) %s)" % (topmod, len(cover_desc), cover_expr))
+        group = set(range(jobidx, len(cover_desc), jobs))
+
+        for step in range(num_steps):
+            if len(group) == 0:
+                break
+            job_assert_step(solver, step, bmc_step_asserts(step))
+
+            while True:
+                for i in [i for i in group if reached[i] == step]:
+                    print_msg("Reached cover statement at %s in step %d (job %d)." % (cover_desc[i], step, jobidx))
+                    first_reached[i] = step
+                    group.remove(i)
+                if len(group) == 0:
+                    break
+
+                print_msg("Checking cover reachability in step %d (job %d).." % (step, jobidx))
+                mask = "".join("1" if i in group else "0" for i in range(len(cover_desc)))
+                lit = job_query_start(solver)
+                job_query_assert(solver, lit, "(distinct (bvand (covers_0 s%d) #b%s) #b%s)" % (step, mask, "0" * len(cover_desc)))
+                if await job_query_check(solver, lit) == "unsat":
+                    job_query_end(solver, lit)
+                    break
+
+                reached_covers = solver.bv2bin(await solver.get("(covers_0 s%d)" % step))
+                job_query_end(solver, lit)
+                for i in range(len(reached_covers)):
+                    if reached_covers[i] == "1" and (reached[i] is None or reached[i] > step):
+                        reached[i] = step
+
+    async def run():
+        await asyncio.gather(*[job(i, solver) for i, solver in enumerate(solvers)])
+        await job_kill(solvers)
+
+    asyncio.run(run())
+    return first_reached
+
+keep_going_loop = None
+keep_going_jobs = list()
+keep_going_next = None
+
+def bmc_keep_going_start(step, last_check_step, active_assert_keys):
+    # --keep-going with --jobs: the assertions are split between the
+    # solvers, and each one keeps checking its share of the given steps
+    # until none of it can fail any more. Before that the solvers assume
+    # the assertions that are still active in all earlier steps, like
+    # the main solver, so together they find the same failing assertions
+    # as the loop in the BMC code. The result is a list with one
+    # (keys, exprs) pair per model found.
+
+    # the jobs run in another thread, so they get a copy of the keys
+    active_assert_keys = frozenset(active_assert_keys)
+
+    async def job(entry):
+        solver = entry["solver"]
+        while entry["steps"] <= last_check_step:
+            job_assert_step(solver, entry["steps"], bmc_step_asserts(entry["steps"]))
+            entry["steps"] += 1
+
+        # the steps before this window are assumed only now, with the
+        # assertions the main solver has left active after their checks
+        while entry["assumed"] < step:
+            i = entry["assumed"]
+            if i >= skip_steps:
+                for assert_data in get_active_assert_map(i, active_assert_keys).values():
+                    job_assert(solver, assert_data[0])
+            elif assume_skipped is not None and i >= assume_skipped:
+                job_assert(solver, "(|%s_a| s%d)" % (topmod, i))
+                job_assert(solver, get_constr_expr(constr_asserts, i))
+            entry["assumed"] += 1
+
+        results = list()
+        entry["keys"] &= active_assert_keys
+        while entry["keys"]:
+            assert_data = list()
+            for i in range(step, last_check_step+1):
+                assert_data.extend(get_active_assert_map(i, entry["keys"]).items())
+            if len(assert_data) == 0:
+                break
+
+            lit = job_query_start(solver)
+            if len(assert_data) == 1:
+                job_query_assert(solver, lit, "(not %s)" % assert_data[0][1][0])
+            else:
+                job_query_assert(solver, lit, "(not (and %s))" % " ".join(data[0] for key, data in assert_data))
+            if await job_query_check(solver, lit) == "unsat":
+                job_query_end(solver, lit)
+                break
+
+            failed_keys = set()
+            failed_exprs = list()
+            values = solver.bv2int_list(await solver.get_list([data[0] for key, data in assert_data]))
+            for (key, data), value in zip(assert_data, values):
+                if not value:
+                    failed_keys.add(key)
+                    failed_exprs.append(data[0])
+            job_query_end(solver, lit)
+
+            entry["keys"] -= failed_keys
+            results.append((failed_keys, failed_exprs))
+        return results
+
+    async def guarded_job(entry):
+        # a solver error ends with sys.exit(), which would stop the event
+        # loop and leave the main thread waiting for the result forever,
+        # so it is passed on to the main thread instead
+        try:
+            return await job(entry)
+        except SystemExit as e:
+            return e
+
+    async def run():
+        results = await asyncio.gather(*[guarded_job(entry) for entry in keep_going_jobs])
+        for job_results in results:
+            if isinstance(job_results, SystemExit):
+                return job_results
+        return [result for job_results in results for result in job_results]
+
+    return (step, last_check_step, active_assert_keys, asyncio.run_coroutine_threadsafe(run(), keep_going_loop))
+
+def bmc_keep_going_parallel(step, last_check_step, active_assert_keys):
+    # Returns the models for the given steps. The solvers run in an event
+    # loop of their own, so they already work on the next steps while the
+    # main solver handles these. That only happens when the set of active
+    # assertions is known for the next steps, i.e. here when no
+    # assertion failed, otherwise in bmc_keep_going_prefetch().
+    global keep_going_loop, keep_going_next
+
+    if keep_going_loop is None:
+        print_msg("Starting %d solvers for parallel assertion checks.." % jobs)
+        keys = sorted(active_assert_keys, key=repr)
+        for i in range(jobs):
+            keep_going_jobs.append(dict(solver=job_solver(models=True), keys=set(keys[i::jobs]), steps=0, assumed=0))
+        keep_going_loop = asyncio.new_event_loop()
+        Thread(target=keep_going_loop.run_forever, daemon=True).start()
+
+    if keep_going_next is not None and keep_going_next[:3] != (step, last_check_step, frozenset(active_assert_keys)):
+        # the solvers can only work on one window at a time
+        bmc_keep_going_result()
+    if keep_going_next is None:
+        keep_going_next = bmc_keep_going_start(step, last_check_step, active_assert_keys)
+    results = bmc_keep_going_result()
+
+    if len(results) == 0:
+        bmc_keep_going_prefetch(step, last_check_step, active_assert_keys)
+
+    return results
+
+def bmc_keep_going_prefetch(step, last_check_step, active_assert_keys):
+    # starts the checks of the steps after the given ones, once the main
+    # solver has removed all assertions that failed in them
+    global keep_going_next
+    if keep_going_next is None and last_check_step + 1 < num_steps and active_assert_keys:
+        keep_going_next = bmc_keep_going_start(last_check_step + 1, min(last_check_step + 1 + step_size, num_steps) - 1, active_assert_keys)
+
+def bmc_keep_going_result():
+    global keep_going_next
+    results = keep_going_next[3].result()
+    keep_going_next = None
+    if isinstance(results, SystemExit):
+        raise results
+    return results
+
+def bmc_keep_going_close():
+    if keep_going_loop is not None:
+        if keep_going_next is not None:
+            keep_going_next[3].cancel()
+        asyncio.run_coroutine_threadsafe(job_kill([entry["solver"] for entry in keep_going_jobs]), keep_going_loop).result()
+        keep_going_loop.call_soon_threadsafe(keep_going_loop.stop)
 
 if tempind:
     retstatus = "FAILED"
+    ind_steps = range(num_steps, -1, -1)
+
+    # with --jobs only the check in step 0 is repeated on the main
+    # solver, to write the trace when induction failed
+    parallel_swept = jobs > 1 and not smt.forall
+    if parallel_swept:
+        parallel_depth = induction_parallel()
+        if parallel_depth is not None:
+            print_msg("Temporal induction successful with depth %d." % parallel_depth)
+            retstatus = "PASSED"
+            ind_steps = []
+
     skip_counter = step_size
-    for step in range(num_steps, -1, -1):
+    for step in ind_steps:
         if smt.forall:
             print_msg("Temporal induction not supported for exists-forall problems.")
             break
 
-        smt_state(step)
-        smt_assert_consequent("(|%s_u| s%d)" % (topmod, step))
-        smt_assert_antecedent("(|%s_h| s%d)" % (topmod, step))
-        smt_assert_antecedent("(not (|%s_is| s%d))" % (topmod, step))
-        smt_assert_consequent(get_constr_expr(constr_assumes, step))
-
-        if step == num_steps:
-            smt_assert("(not (and (|%s_a| s%d) %s))" % (topmod, step, get_constr_expr(constr_asserts, step)))
+        smt.stats_phase = ("induction", step)
 
-        else:
-            smt_assert_antecedent("(|%s_t| s%d s%d)" % (topmod, step, step+1))
-            smt_assert("(|%s_a| s%d)" % (topmod, step))
-            smt_assert(get_constr_expr(constr_asserts, step))
+        smt_assert_step(step, induction_step_asserts(step))
 
         if step > num_steps-skip_steps:
             print_msg("Skipping induction in step %d.." % (step))
             continue
 
+        if parallel_swept and step > 0:
+            continue
+
         skip_counter += 1
         if skip_counter < step_size:
             print_msg("Skipping induction in step %d.." % (step))
@@ -1415,6 +2036,15 @@ elif covermode:
     else:
         cover_expr = "#b0"
 
+    # first step in which each cover is reached, from the --jobs solvers
+    parallel_reached = None
+    if jobs > 1 and not smt.forall:
+        parallel_reached = cover_parallel(cover_expr, cover_desc)
+
+    # the remaining covers are masked directly instead of with the chain
+    # of covers_N definitions when the solver doesn't need to pop them
+    cover_chain = parallel_reached is None and not smt_query_assuming()
+
     coveridx = 0
     smt.write("(define-fun covers_0 ((state |%s_s|)) (_ BitVec %d) %s)" % (topmod, len(cover_desc), cover_expr))
 
@@ -1425,29 +2055,22 @@ elif covermode:
     assert step_size == 1
 
     while step < num_steps:
-        smt_state(step)
-        smt_assert_consequent("(|%s_u| s%d)" % (topmod, step))
-        smt_assert_antecedent("(|%s_h| s%d)" % (topmod, step))
-        smt_assert_consequent(get_constr_expr(constr_assumes, step))
-
-        if step == 0:
-            if noinit:
-                smt_assert_antecedent("(not (|%s_is| s%d))" % (topmod, step))
-            else:
-                smt_assert_antecedent("(|%s_i| s0)" % (topmod))
-                smt_assert_antecedent("(|%s_is| s0)" % (topmod))
-
-        else:
-            smt_assert_antecedent("(|%s_t| s%d s%d)" % (topmod, step-1, step))
-            smt_assert_antecedent("(not (|%s_is| s%d))" % (topmod, step))
+        smt.stats_phase = ("cover", step)
+        smt_assert_step(step, bmc_step_asserts(step))
 
         while "1" in cover_mask:
+            if parallel_reached is not None and step not in [parallel_reached[i] for i in range(len(cover_mask)) if cover_mask[i] == "1"]:
+                break
+
             print_msg("Checking cover reachability in step %d.." % (step))
-            smt_push()
-            smt_assert("(distinct (covers_%d s%d) #b%s)" % (coveridx, step, "0" * len(cover_desc)))
+            smt_query_start()
+            if cover_chain:
+                smt_query_assert("(distinct (covers_%d s%d) #b%s)" % (coveridx, step, "0" * len(cover_desc)))
+            else:
+                smt_query_assert("(distinct (bvand (covers_0 s%d) #b%s) #b%s)" % (step, cover_mask, "0" * len(cover_desc)))
 
             if smt_check_sat() == "unsat":
-                smt_pop()
+                smt_query_end()
                 break
 
             if append_steps > 0:
@@ -1466,7 +2089,11 @@ elif covermode:
                     retstatus = "FAILED"
                     break
 
-            reached_covers = smt.bv2bin(smt.get("(covers_%d s%d)" % (coveridx, step)))
+            if cover_chain:
+                reached_covers = smt.bv2bin(smt.get("(covers_%d s%d)" % (coveridx, step)))
+            else:
+                reached_covers = smt.bv2bin(smt.get("(covers_0 s%d)" % (step)))
+                reached_covers = "".join("1" if a == "1" and b == "1" else "0" for a, b in zip(reached_covers, cover_mask))
             assert len(reached_covers) == len(cover_desc)
 
             new_cover_mask = []
@@ -1491,8 +2118,9 @@ elif covermode:
                 break
 
             coveridx += 1
-            smt_pop()
-            smt.write("(define-fun covers_%d ((state |%s_s|)) (_ BitVec %d) (bvand (covers_%d state) #b%s))" % (coveridx, topmod, len(cover_desc), coveridx-1, cover_mask))
+            smt_query_end()
+            if cover_chain:
+                smt.write("(define-fun covers_%d ((state |%s_s|)) (_ BitVec %d) (bvand (covers_%d state) #b%s))" % (coveridx, topmod, len(cover_desc), coveridx-1, cover_mask))
 
         if found_failed_assert:
             break
@@ -1501,6 +2129,9 @@ elif covermode:
             retstatus = "PASSED"
             break
 
+        if parallel_reached is not None and all(parallel_reached[i] is None for i in range(len(cover_mask)) if cover_mask[i] == "1"):
+            break
+
         step += 1
 
     if "1" in cover_mask:
@@ -1513,24 +2144,30 @@ else:  # not tempind, covermode
     failed_assert_infomap = dict()
     traceidx = 0
 
+    # checks before this step are known to pass from the --jobs solvers
+    parallel_passed = 0
+    if kind and smt.forall:
+        print_msg("Temporal induction not supported for exists-forall problems.")
+        num_steps = 0
+    elif (jobs > 1 or kind) and not gentrace and not final_only and not smt.forall:
+        parallel_passed = bmc_parallel(active_assert_keys)
+
+    # for a trace the main solver repeats the checks before the failing
+    # one, so that its model is the same as without --jobs
+    parallel_trace = vcdfile is not None or vlogtbfile is not None or outconstr is not None
+    parallel_replay = parallel_trace and 0 < parallel_passed != (num_steps if kind_depth is None else skip_steps + kind_depth)
+    if parallel_replay:
+        print_msg("Repeating the checks before step %d on the main solver for the trace.." % parallel_passed)
+
     step = 0
     retstatus = "PASSED"
     while step < num_steps:
-        smt_state(step)
-        smt_assert_consequent("(|%s_u| s%d)" % (topmod, step))
-        smt_assert_antecedent("(|%s_h| s%d)" % (topmod, step))
-        smt_assert_consequent(get_constr_expr(constr_assumes, step))
-
-        if step == 0:
-            if noinit:
-                smt_assert_antecedent("(not (|%s_is| s%d))" % (topmod, step))
-            else:
-                smt_assert_antecedent("(|%s_i| s0)" % (topmod))
-                smt_assert_antecedent("(|%s_is| s0)" % (topmod))
+        if kind_depth is not None and step >= skip_steps + kind_depth:
+            print_msg("Proved by induction with %d steps." % kind_depth)
+            break
 
-        else:
-            smt_assert_antecedent("(|%s_t| s%d s%d)" % (topmod, step-1, step))
-            smt_assert_antecedent("(not (|%s_is| s%d))" % (topmod, step))
+        smt.stats_phase = ("bmc", step)
+        smt_assert_step(step, bmc_step_asserts(step))
 
         if step < skip_steps:
             if assume_skipped is not None and step >= assume_skipped:
@@ -1554,7 +2191,7 @@ else:  # not tempind, covermode
                 last_check_step = step+i
 
         if not gentrace:
-            if presat:
+            if presat and (step >= parallel_passed or parallel_replay):
                 if last_check_step == step:
                     print_msg("Checking assumptions in step %d.." % (step))
                 else:
@@ -1565,7 +2202,76 @@ else:  # not tempind, covermode
                     retstatus = "PREUNSAT"
                     break
 
-            if not final_only:
+            if not final_only and step >= parallel_passed and keep_going and jobs > 1:
+                if last_check_step == step:
+                    print_msg("Checking assertions in step %d on %d solvers.." % (step, jobs))
+                else:
+                    print_msg("Checking assertions in steps %d to %d on %d solvers.." % (step, last_check_step, jobs))
+
+                for failed_keys, failed_exprs in bmc_keep_going_parallel(step, last_check_step, active_assert_keys):
+                    if not failed_keys & active_assert_keys:
+                        # all of them failed in an earlier model already
+                        continue
+
+                    if retstatus != "FAILED":
+                        print("%s BMC failed!" % smt.timestamp())
+
+                    if not smt.produce_models:
+                        # no messages or traces, so no need for the model
+                        for key in failed_keys:
+                            active_assert_keys.remove(key)
+                        retstatus = "FAILED"
+                        continue
+
+                    # the same failures again on the main solver, for the trace,
+                    # in the order of the --jobs solvers
+                    smt_query_start()
+                    for expr in failed_exprs:
+                        smt_query_assert("(not %s)" % expr)
+                    smt_check_sat(["sat"])
+
+                    if append_steps > 0:
+                        for i in range(last_check_step+1, last_check_step+1+append_steps):
+                            print_msg("Appending additional step %d." % i)
+                            smt_state(i)
+                            smt_assert_antecedent("(not (|%s_is| s%d))" % (topmod, i))
+                            smt_assert_consequent("(|%s_u| s%d)" % (topmod, i))
+                            smt_assert_antecedent("(|%s_h| s%d)" % (topmod, i))
+                            smt_assert_antecedent("(|%s_t| s%d s%d)" % (topmod, i-1, i))
+                            smt_assert_consequent(get_constr_expr(constr_assumes, i))
+                        print_msg("Re-solving with appended steps..")
+                        if smt_check_sat() == "unsat":
+                            print("%s Cannot append steps without violating assumptions!" % smt.timestamp())
+                            retstatus = "FAILED"
+                            smt_query_end()
+                            break
+                    print_anyconsts(step)
+
+                    for i in range(step, last_check_step+1):
+                        print_failed_asserts(i, infomap=failed_assert_infomap)
+
+                    # like the loop below, everything that fails in this
+                    # model is done, not just what the --jobs solver found
+                    assert_data = list()
+                    for i in range(step, last_check_step+1):
+                        assert_data.extend(get_active_assert_map(i, active_assert_keys).items())
+                    values = smt.bv2int_list(smt.get_list([expr for key, (expr, path, desc) in assert_data]))
+                    for (key, (expr, path, desc)), value in zip(assert_data, values):
+                        if key in active_assert_keys and not value:
+                            failed_assert_infomap[key] = " [failed before]"
+                            active_assert_keys.remove(key)
+
+                    write_trace(0, last_check_step+1+append_steps, "%d" % traceidx)
+                    traceidx += 1
+                    retstatus = "FAILED"
+                    smt_query_end()
+
+                bmc_keep_going_prefetch(step, last_check_step, active_assert_keys)
+
+                if retstatus == "FAILED" and not active_assert_keys:
+                    break
+
+            elif not final_only and (step >= parallel_passed or parallel_replay):
                 recheck_current_step = True
                 while recheck_current_step:
                     recheck_current_step = False
@@ -1573,7 +2279,7 @@ else:  # not tempind, covermode
                         print_msg("Checking assertions in step %d.." % (step))
                     else:
                         print_msg("Checking assertions in steps %d to %d.." % (step, last_check_step))
-                    smt_push()
+                    smt_query_start()
 
                     active_assert_maps = dict()
                     active_assert_exprs = list()
@@ -1588,9 +2294,9 @@ else:  # not tempind, covermode
                         else:
                             active_assert_expr = "(and %s)" % " ".join(active_assert_exprs)
 
-                        smt_assert("(not %s)" % active_assert_expr)
+                        smt_query_assert("(not %s)" % active_assert_expr)
                     else:
-                        smt_assert("false")
+                        smt_query_assert("false")
 
 
                     if smt_check_sat() == "sat":
@@ -1617,12 +2323,15 @@ else:  # not tempind, covermode
                             print_failed_asserts(i, infomap=failed_assert_infomap)
 
                         if keep_going:
+                            assert_data = list()
                             for i in range(step, last_check_step+1):
-                                for key, (expr, path, desc) in active_assert_maps[i].items():
-                                    if key in active_assert_keys and not smt.bv2int(smt.get(expr)):
-                                        failed_assert_infomap[key] = " [failed before]"
+                                assert_data.extend(active_assert_maps[i].items())
+                            values = smt.bv2int_list(smt.get_list([expr for key, (expr, path, desc) in assert_data]))
+                            for (key, (expr, path, desc)), value in zip(assert_data, values):
+                                if key in active_assert_keys and not value:
+                                    failed_assert_infomap[key] = " [failed before]"
 
-                                        active_assert_keys.remove(key)
+                                    active_assert_keys.remove(key)
 
                             if active_assert_keys:
                                 recheck_current_step = True
@@ -1631,7 +2340,7 @@ else:  # not tempind, covermode
                         traceidx += 1
                         retstatus = "FAILED"
 
-                    smt_pop()
+                    smt_query_end()
                     if recheck_current_step:
                         print_msg("Checking remaining assertions..")
 
@@ -1650,10 +2359,10 @@ else:  # not tempind, covermode
                         continue
 
                     print_msg("Checking final constraints in step %d.." % (i))
-                    smt_push()
+                    smt_query_start()
 
-                    smt_assert_consequent(get_constr_expr(constr_assumes, i, final=True))
-                    smt_assert("(not %s)" % get_constr_expr(constr_asserts, i, final=True))
+                    smt_query_assert(get_constr_expr(constr_assumes, i, final=True), consequent=True)
+                    smt_query_assert("(not %s)" % get_constr_expr(constr_asserts, i, final=True))
 
                     if smt_check_sat() == "sat":
                         print("%s BMC failed!" % smt.timestamp())
@@ -1663,7 +2372,7 @@ else:  # not tempind, covermode
                         retstatus = "FAILED"
                         break
 
-                    smt_pop()
+                    smt_query_end()
                 if retstatus == "FAILED" or retstatus == "PREUNSAT":
                     break
 
@@ -1689,9 +2398,28 @@ else:  # not tempind, covermode
         print_anyconsts(0)
         write_trace(0, num_steps, '%')
 
+    # BMC passed but induction did not prove the assertions
+    if kind and kind_depth is None and retstatus == "PASSED":
+        retstatus = "FAILED"
+
+    bmc_keep_going_close()
+
 
 smt.write("(exit)")
 smt.wait()
 
+if smt.portfolio is not None:
+    smt.portfolio_report()
+
+if smt.cache_dir is not None:
+    smt.cache_report()
+
+if so.debug_print:
+    print_msg("Solver input: %d bytes in %d flushes" % (smt.p_bytes_written, smt.p_flushes))
+
+if statsfile is not None:
+    with open(statsfile, "w") as f:
+        json.dump(smt.stats_report(), f, indent=2)
+
 print_msg("Status: %s" % retstatus)
 sys.exit(0 if retstatus == "PASSED" else 1)
@@ -16,19 +16,18 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
-import sys, re, os, signal
-import subprocess
+import sys, re, os, signal, hashlib, json, mmap, pickle, array
+import subprocess, selectors, asyncio
 if os.name == "posix":
     import resource
-from copy import copy
 from select import select
 from time import time
 from queue import Queue, Empty
 from threading import Thread
 
 
-# This is needed so that the recursive SMT2 S-expression parser
-# does not run out of stack frames when parsing large expressions
+# This is needed so that the recursive SMT2 S-expression helpers (unparse,
+# unroll_text) do not run out of stack frames when handling large expressions
 if os.name == "posix":
     smtio_reclimit = 64 * 1024
     if sys.getrecursionlimit() < smtio_reclimit:
@@ -61,7 +60,8 @@ def force_shutdown(signum, frame):
         forced_shutdown = True
         if signum is not None:
             print("<%s>" % signal.Signals(signum).name)
-        for p in running_solvers.values():
+        # copied, the --keep-going --jobs solvers start in another thread
+        for p in list(running_solvers.values()):
             # os.killpg(os.getpgid(p.pid), signal.SIGTERM)
             os.kill(p.pid, signal.SIGTERM)
     sys.exit(1)
@@ -79,35 +79,462 @@ def except_hook(exctype, value, traceback):
 sys.excepthook = except_hook
 
 
-hex_dict = {
-    "0": "0000", "1": "0001", "2": "0010", "3": "0011",
-    "4": "0100", "5": "0101", "6": "0110", "7": "0111",
-    "8": "1000", "9": "1001", "A": "1010", "B": "1011",
-    "C": "1100", "D": "1101", "E": "1110", "F": "1111",
-    "a": "1010", "b": "1011", "c": "1100", "d": "1101",
-    "e": "1110", "f": "1111"
-}
+# tokens of an SMT2 S-expression: parens, |quoted symbols| and plain atoms
+smt2_token_regex = re.compile(r"[()]|\|[^|]*\||[^\s()|]+")
+
+# statements that --unroll needs to look at before rewriting
+smt2_decl_regex = re.compile(r"\(\s*(declare-sort|declare-fun|define-fun)[\s(]")
+
+# used by SmtIo.load() to split off metadata, comments and statements that
+# need to be looked at one by one
+smt2_info_regex = re.compile(rb"\n; (yosys-smt2-[a-z-]+)[^\n]*")
+smt2_comment_regex = re.compile(r";[^\n]*")
+smt2_blank_regex = re.compile(r"\n\s*\n")
+smt2_stmt_regex = re.compile(r"\n(?=\()")
+smt2_control_regex = re.compile(r"\((push|pop|check-sat|get-|exit|reset|assert)\b")
 
 
 class SmtModInfo:
+    # Nets are kept in parallel arrays (interned name, width, kind bits)
+    # instead of one set per kind plus a dict of widths. The inputs,
+    # outputs, registers, wires and wsize views are only built when they
+    # are first used, and all other containers only when first accessed,
+    # so the many small modules of a large design stay cheap.
+
+    NET_INPUT = 1
+    NET_OUTPUT = 2
+    NET_REGISTER = 4
+    NET_WIRE = 8
+
+    net_views = {"inputs": NET_INPUT, "outputs": NET_OUTPUT, "registers": NET_REGISTER, "wires": NET_WIRE}
+
+    containers = {
+        "memories": dict, "clocks": dict, "cells": dict, "asserts": dict, "covers": dict,
+        "maximize": set, "minimize": set, "anyconsts": dict, "anyseqs": dict,
+        "allconsts": dict, "allseqs": dict, "asize": dict,
+    }
+
+    __slots__ = ("net_names", "net_widths", "net_kinds", "net_viewed", "inputs", "outputs",
+                 "registers", "wires", "wsize") + tuple(containers)
+
     def __init__(self):
-        self.inputs = set()
-        self.outputs = set()
-        self.registers = set()
-        self.memories = dict()
-        self.wires = set()
-        self.wsize = dict()
-        self.clocks = dict()
-        self.cells = dict()
-        self.asserts = dict()
-        self.covers = dict()
-        self.maximize = set()
-        self.minimize = set()
-        self.anyconsts = dict()
-        self.anyseqs = dict()
-        self.allconsts = dict()
-        self.allseqs = dict()
-        self.asize = dict()
+        self.net_names = list()
+        self.net_widths = array.array("I")
+        self.net_kinds = bytearray()
+        self.net_viewed = False
+
+    def __getattr__(self, name):
+        # only called for slots that have not been set yet
+        if name in SmtModInfo.net_views:
+            mask = SmtModInfo.net_views[name]
+            value = set(net for net, kind in zip(self.net_names, self.net_kinds) if kind & mask)
+            self.net_viewed = True
+        elif name == "wsize":
+            value = dict(zip(self.net_names, self.net_widths))
+            self.net_viewed = True
+        elif name in SmtModInfo.containers:
+            value = SmtModInfo.containers[name]()
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+    def add_net(self, name, width, kind):
+        # write_smt2 emits all lines for one net back to back
+        if len(self.net_names) != 0 and self.net_names[-1] == name:
+            self.net_widths[-1] = width
+            self.net_kinds[-1] |= kind
+        else:
+            self.net_names.append(sys.intern(name))
+            self.net_widths.append(width)
+            self.net_kinds.append(kind)
+
+        if self.net_viewed:
+            for view in ("inputs", "outputs", "registers", "wires", "wsize"):
+                try:
+                    delattr(self, view)
+                except AttributeError:
+                    pass
+            self.net_viewed = False
+
+    def peek(self, name):
+        # like getattr(), but doesn't store a new container if it is missing
+        try:
+            return object.__getattribute__(self, name)
+        except AttributeError:
+            return SmtModInfo.containers[name]()
+
+    def nets(self):
+        # sorted (name, width, kind) tuples, one per net, without
+        # building any of the views
+        result = list()
+        for name, width, kind in sorted(zip(self.net_names, self.net_widths, self.net_kinds)):
+            if len(result) != 0 and result[-1][0] == name:
+                kind |= result[-1][2]
+                result[-1] = (name, width, kind)
+            else:
+                result.append((name, width, kind))
+        return result
+
+
+class SmtHierIndex:
+    # Flattened view of the hierarchy below one module. Expressions are
+    # stored as (prefix, suffix) pairs that are put around the state
+    # expression, so every lookup is a single dict access.
+
+    def __init__(self, modinfo, top):
+        self.exprs = dict()
+        self.nets = dict()
+        self.mems = dict()
+        self.paths = dict()
+        self.hiernets = list()
+        self.hierregs = list()
+        self.hiermems = list()
+        self.hieranyconsts = list()
+        self.hieranyseqs = list()
+        self.hierallconsts = list()
+        self.hierallseqs = list()
+        self.exprs[()] = ("", "")
+        self.build(modinfo, top, (), "", "")
+
+    def add_path(self, path):
+        key = ".".join(path)
+        if key in self.paths and self.paths[key] != path:
+            # ambiguous, get_path() falls back to walking the hierarchy
+            self.paths[key] = None
+        else:
+            self.paths[key] = path
+
+    def build(self, modinfo, mod, cursor, prefix, suffix):
+        info = modinfo[mod]
+        clocks = info.peek("clocks")
+        memories = info.peek("memories")
+        asize = info.peek("asize")
+
+        for netname, width, kind in info.nets():
+            path = cursor + (netname,)
+            netprefix = "(|%s_n %s| " % (mod, netname) + prefix
+            self.nets[path] = (netprefix, suffix + ")", width, clocks.get(netname))
+            self.exprs[path] = (netprefix, suffix + ")")
+            self.hiernets.append(path)
+            if kind & SmtModInfo.NET_REGISTER:
+                self.hierregs.append(path)
+            self.add_path(path)
+
+        for memname in sorted(memories.keys()):
+            path = cursor + (memname,)
+            self.mems[path] = (mod, memname, prefix, suffix, memories[memname])
+            self.exprs.setdefault(path, ("(|%s_m %s| " % (mod, memname) + prefix, suffix + ")"))
+            self.hiermems.append(path)
+            self.add_path(path)
+
+        for results, items in ((self.hieranyconsts, info.peek("anyconsts")), (self.hieranyseqs, info.peek("anyseqs")),
+                               (self.hierallconsts, info.peek("allconsts")), (self.hierallseqs, info.peek("allseqs"))):
+            for name, value in sorted(items.items()):
+                results.append((cursor, name, value[0], value[1], asize[name]))
+
+        for cellname, celltype in sorted(info.peek("cells").items()):
+            path = cursor + (cellname,)
+            cellprefix = "(|%s_h %s| " % (mod, cellname) + prefix
+            cellsuffix = suffix + ")"
+            self.exprs[path] = (cellprefix, cellsuffix)
+            self.add_path(path)
+            self.build(modinfo, celltype, path, cellprefix, cellsuffix)
+
+
+class SmtModelError(Exception):
+    pass
+
+
+class SmtModel:
+    # Evaluates expressions against a model returned by (get-model). Only
+    # models given as (define-fun ...) statements are understood. Anything
+    # that can't be evaluated raises SmtModelError, so the caller can ask
+    # the solver instead.
+
+    def __init__(self, model, defs, parse):
+        self.funs = dict()
+        self.values = set()
+        self.defs = defs
+        self.parse = parse
+        self.cache = dict()
+
+        if len(model) != 0 and model[0] == "model":
+            model = model[1:]
+
+        for stmt in model:
+            if not isinstance(stmt, list) or len(stmt) < 4:
+                continue
+            if stmt[0] == "define-fun" and len(stmt) == 5:
+                self.funs[self.symbol(stmt[1])] = ([p[0] for p in stmt[2]], stmt[4])
+            elif stmt[0] == "declare-fun" and stmt[2] == []:
+                self.values.add(self.symbol(stmt[1]))
+
+    def symbol(self, name):
+        if name.startswith("|") and name.endswith("|"):
+            return name[1:-1]
+        return name
+
+    def lookup(self, name):
+        if name in self.funs:
+            return self.funs[name]
+        if name in self.defs:
+            stmt = self.defs[name]
+            if isinstance(stmt, str):
+                stmt = self.parse(stmt)
+                stmt = ([p[0] for p in stmt[2]], stmt[4])
+                self.defs[name] = stmt
+            return stmt
+        raise SmtModelError("unknown function %s" % name)
+
+    def call(self, name, args):
+        key = (name,) + tuple(args)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            key = None
+        params, body = self.lookup(name)
+        if len(params) != len(args):
+            raise SmtModelError("wrong number of arguments for %s" % name)
+        value = self.eval(body, dict(zip(params, args)))
+        if key is not None:
+            self.cache[key] = value
+        return value
+
+    def format(self, value):
+        if value is True:
+            return "true"
+        if value is False:
+            return "false"
+        if isinstance(value, tuple) and value[0] == "bv":
+            # same literals as the solvers print for (get-value)
+            if value[1] == 0:
+                return "#b"
+            if value[1] % 4 == 0:
+                return "#x" + format(value[2], "0%dx" % (value[1] // 4))
+            return "#b" + format(value[2], "0%db" % value[1])
+        raise SmtModelError("can't format value %s" % (value,))
+
+    def eval(self, expr, env=None):
+        if env is None:
+            env = dict()
+
+        if not isinstance(expr, list):
+            if expr in env:
+                return env[expr]
+            if expr == "true":
+                return True
+            if expr == "false":
+                return False
+            if expr.startswith("#b"):
+                return ("bv", len(expr) - 2, int(expr[2:], 2))
+            if expr.startswith("#x"):
+                return ("bv", 4 * (len(expr) - 2), int(expr[2:], 16))
+            name = self.symbol(expr)
+            if name in self.values:
+                return name
+            return self.call(name, [])
+
+        if len(expr) == 0:
+            raise SmtModelError("empty expression")
+
+        head = expr[0]
+
+        if head == "_":
+            if len(expr) == 3 and expr[1].startswith("bv") and expr[1][2:].isdigit():
+                return ("bv", int(expr[2]), int(expr[1][2:]) % (1 << int(expr[2])))
+            if len(expr) == 3 and expr[1] == "as-array":
+                return ("fun", self.symbol(expr[2]))
+            raise SmtModelError("unsupported expression %s" % expr[1])
+
+        if head == "as":
+            if len(expr) == 3 and not isinstance(expr[1], list):
+                return self.symbol(expr[1])
+            raise SmtModelError("unsupported as-expression")
+
+        if head == "ite":
+            cond = self.eval(expr[1], env)
+            if not isinstance(cond, bool):
+                raise SmtModelError("non-Boolean ite condition")
+            return self.eval(expr[2] if cond else expr[3], env)
+
+        if head == "let":
+            newenv = dict(env)
+            for name, value in expr[1]:
+                newenv[name] = self.eval(value, env)
+            return self.eval(expr[2], newenv)
+
+        if head == "lambda":
+            return ("lambda", tuple(p[0] for p in expr[1]), expr[2], env)
+
+        args = [self.eval(arg, env) for arg in expr[1:]]
+
+        if isinstance(head, list):
+            if len(head) == 3 and head[0] == "as" and head[1] == "const":
+                return ("array", args[0], ())
+            if len(head) >= 3 and head[0] == "_" and head[1] in smt2_indexed_ops:
+                return smt2_indexed_ops[head[1]]([int(i) for i in head[2:]], *self.bvargs(args))
+            raise SmtModelError("unsupported operator")
+
+        if head in smt2_bool_ops:
+            for arg in args:
+                if not isinstance(arg, bool):
+                    raise SmtModelError("non-Boolean argument for %s" % head)
+            return smt2_bool_ops[head](args)
+
+        if head in smt2_bv_ops:
+            return smt2_bv_ops[head](*self.bvargs(args))
+
+        if head in ("=", "distinct"):
+            for arg in args:
+                if isinstance(arg, tuple) and arg[0] != "bv":
+                    raise SmtModelError("can't compare array values")
+            if head == "=":
+                return all(arg == args[0] for arg in args[1:])
+            return len(set(args)) == len(args)
+
+        if head == "select":
+            return self.select(args[0], args[1])
+
+        if head == "store":
+            if not isinstance(args[0], tuple) or args[0][0] != "array":
+                raise SmtModelError("unsupported array value")
+            return ("array", args[0][1], args[0][2] + ((args[1], args[2]),))
+
+        return self.call(self.symbol(head), args)
+
+    def bvargs(self, args):
+        for arg in args:
+            if not isinstance(arg, tuple) or arg[0] != "bv":
+                raise SmtModelError("non-bitvector argument")
+        return [arg[1] for arg in args], [arg[2] for arg in args]
+
+    def select(self, array, index):
+        if isinstance(array, tuple):
+            if array[0] == "array":
+                for key, value in reversed(array[2]):
+                    if key == index:
+                        return value
+                    if not isinstance(key, tuple) or key[0] != "bv":
+                        raise SmtModelError("unsupported array index")
+                return array[1]
+            if array[0] == "fun":
+                return self.call(array[1], [index])
+            if array[0] == "lambda" and len(array[1]) == 1:
+                env = dict(array[3])
+                env[array[1][0]] = index
+                return self.eval(array[2], env)
+        raise SmtModelError("unsupported array value")
+
+
+def smt2_signed(width, value):
+    if width != 0 and value >> (width - 1):
+        return value - (1 << width)
+    return value
+
+def smt2_bv(width, value):
+    return ("bv", width, value & ((1 << width) - 1))
+
+def smt2_bv_nary(fn):
+    def worker(widths, values):
+        result = values[0]
+        for value in values[1:]:
+            result = fn(result, value)
+        return smt2_bv(widths[0], result)
+    return worker
+
+def smt2_bv_udiv(widths, values):
+    if values[1] == 0:
+        return smt2_bv(widths[0], -1)
+    return smt2_bv(widths[0], values[0] // values[1])
+
+def smt2_bv_urem(widths, values):
+    if values[1] == 0:
+        return smt2_bv(widths[0], values[0])
+    return smt2_bv(widths[0], values[0] % values[1])
+
+def smt2_bv_sdiv(widths, values):
+    a, b = smt2_signed(widths[0], values[0]), smt2_signed(widths[1], values[1])
+    if b == 0:
+        return smt2_bv(widths[0], 1 if a < 0 else -1)
+    q = abs(a) // abs(b)
+    return smt2_bv(widths[0], -q if (a < 0) != (b < 0) else q)
+
+def smt2_bv_srem(widths, values):
+    a, b = smt2_signed(widths[0], values[0]), smt2_signed(widths[1], values[1])
+    if b == 0:
+        return smt2_bv(widths[0], a)
+    r = abs(a) % abs(b)
+    return smt2_bv(widths[0], -r if a < 0 else r)
+
+def smt2_bv_smod(widths, values):
+    a, b = smt2_signed(widths[0], values[0]), smt2_signed(widths[1], values[1])
+    if b == 0:
+        return smt2_bv(widths[0], a)
+    return smt2_bv(widths[0], a - b * (a // b))
+
+def smt2_bv_concat(widths, values):
+    result = 0
+    for width, value in zip(widths, values):
+        result = (result << width) | value
+    return ("bv", sum(widths), result)
+
+def smt2_bv_rotate(amount, width, value):
+    if width == 0:
+        return ("bv", 0, 0)
+    amount %= width
+    return smt2_bv(width, (value << amount) | (value >> (width - amount)))
+
+smt2_bool_ops = {
+    "not": lambda args: not args[0],
+    "and": lambda args: all(args),
+    "or": lambda args: any(args),
+    "xor": lambda args: sum(args) % 2 == 1,
+    "=>": lambda args: all(args[:-1]) <= args[-1],
+}
+
+smt2_bv_ops = {
+    "bvnot": lambda w, v: smt2_bv(w[0], ~v[0]),
+    "bvneg": lambda w, v: smt2_bv(w[0], -v[0]),
+    "bvand": smt2_bv_nary(lambda a, b: a & b),
+    "bvor": smt2_bv_nary(lambda a, b: a | b),
+    "bvxor": smt2_bv_nary(lambda a, b: a ^ b),
+    "bvnand": lambda w, v: smt2_bv(w[0], ~(v[0] & v[1])),
+    "bvnor": lambda w, v: smt2_bv(w[0], ~(v[0] | v[1])),
+    "bvxnor": lambda w, v: smt2_bv(w[0], ~(v[0] ^ v[1])),
+    "bvadd": smt2_bv_nary(lambda a, b: a + b),
+    "bvsub": lambda w, v: smt2_bv(w[0], v[0] - v[1]),
+    "bvmul": smt2_bv_nary(lambda a, b: a * b),
+    "bvudiv": smt2_bv_udiv,
+    "bvurem": smt2_bv_urem,
+    "bvsdiv": smt2_bv_sdiv,
+    "bvsrem": smt2_bv_srem,
+    "bvsmod": smt2_bv_smod,
+    "bvshl": lambda w, v: smt2_bv(w[0], v[0] << v[1] if v[1] < w[0] else 0),
+    "bvlshr": lambda w, v: smt2_bv(w[0], v[0] >> v[1]),
+    "bvashr": lambda w, v: smt2_bv(w[0], smt2_signed(w[0], v[0]) >> min(v[1], w[0])),
+    "bvult": lambda w, v: v[0] < v[1],
+    "bvule": lambda w, v: v[0] <= v[1],
+    "bvugt": lambda w, v: v[0] > v[1],
+    "bvuge": lambda w, v: v[0] >= v[1],
+    "bvslt": lambda w, v: smt2_signed(w[0], v[0]) < smt2_signed(w[1], v[1]),
+    "bvsle": lambda w, v: smt2_signed(w[0], v[0]) <= smt2_signed(w[1], v[1]),
+    "bvsgt": lambda w, v: smt2_signed(w[0], v[0]) > smt2_signed(w[1], v[1]),
+    "bvsge": lambda w, v: smt2_signed(w[0], v[0]) >= smt2_signed(w[1], v[1]),
+    "bvcomp": lambda w, v: ("bv", 1, int(v[0] == v[1])),
+    "concat": smt2_bv_concat,
+}
+
+smt2_indexed_ops = {
+    "extract": lambda i, w, v: smt2_bv(i[0] - i[1] + 1, v[0] >> i[1]),
+    "zero_extend": lambda i, w, v: ("bv", w[0] + i[0], v[0]),
+    "sign_extend": lambda i, w, v: smt2_bv(w[0] + i[0], smt2_signed(w[0], v[0])),
+    "repeat": lambda i, w, v: smt2_bv_concat(w * i[0], v * i[0]),
+    "rotate_left": lambda i, w, v: smt2_bv_rotate(i[0], w[0], v[0]),
+    "rotate_right": lambda i, w, v: smt2_bv_rotate(-i[0], w[0], v[0]),
+}
 
 
 class SmtIo:
@@ -122,11 +549,25 @@ class SmtIo:
         self.logic_dt = False
         self.forall = False
         self.timeout = 0
+        self.timeout_kill = False
+        self.timeout_deadline = None
+        self.timeout_killed = False
         self.produce_models = True
         self.smt2cache = [list()]
         self.smt2_options = dict()
         self.p = None
         self.p_index = solvers_index
+        self.p_bytes_written = 0
+        self.p_bytes_read = 0
+        self.p_blocked = 0.0
+        self.p_flushes = 0
+        self.portfolio = None
+        self.stats = None
+        self.stats_phase = None
+        self.stats_stmts = 0
+        self.stats_burst = None
+        self.stats_busy = False
+        self.prep_record = None
         solvers_index += 1
 
         if opts is not None:
@@ -142,6 +583,12 @@ class SmtIo:
             self.noincr = opts.noincr
             self.info_stmts = opts.info_stmts
             self.nocomments = opts.nocomments
+            self.warm_pool_size = opts.warm_pool_size
+            self.modeleval = opts.modeleval
+            self.cache_dir = opts.cache_dir
+            self.cache_size = opts.cache_size
+            self.prep_cache_dir = opts.prep_cache_dir
+            self.prep_cache_size = opts.prep_cache_size
 
         else:
             self.solver = "yices"
@@ -155,17 +602,40 @@ class SmtIo:
             self.noincr = False
             self.info_stmts = list()
             self.nocomments = False
-
+            self.warm_pool_size = 0
+            self.modeleval = False
+            self.cache_dir = None
+            self.cache_size = 256
+            self.prep_cache_dir = None
+            self.prep_cache_size = 256
+
+        self.warm_pool = list()
+        self.modeleval_defs = dict()
+        self.modeleval_buffer = ""
+        self.modeleval_sat = False
+        self.modeleval_model = None
+        self.check_sat_cmd = "(check-sat)"
+        self.cache_hash = None
+        self.cache_entry = None
+        self.cache_checked = False
+        self.cache_query = None
+        self.cache_answer = None
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.start_time = time()
 
         self.modinfo = dict()
+        self.hierindex_cache = dict()
         self.curmod = None
         self.topmod = None
         self.setup_done = False
 
     def __del__(self):
         if self.p is not None and not forced_shutdown:
-            os.killpg(os.getpgid(self.p.pid), signal.SIGTERM)
+            if self.p_own_group():
+                os.killpg(self.p.pid, signal.SIGTERM)
+            else:
+                os.kill(self.p.pid, signal.SIGTERM)
             if running_solvers is not None:
                 del running_solvers[self.p_index]
 
@@ -175,6 +645,12 @@ class SmtIo:
         if self.forall:
             self.unroll = False
 
+        if self.solver.startswith("portfolio:"):
+            if self.unroll:
+                self.modeleval = False
+            self.portfolio_setup()
+            return
+
         if self.solver == "yices":
             if self.noincr or self.forall:
                 self.popen_vargs = ['yices-smt2'] + self.solver_opts
@@ -199,9 +675,7 @@ class SmtIo:
 
         if self.solver == "mathsat":
             self.popen_vargs = ['mathsat'] + self.solver_opts
-            if self.timeout != 0:
-                print('timeout option is not supported for mathsat.')
-                sys.exit(1)
+            self.timeout_kill = self.timeout != 0
 
         if self.solver in ["boolector", "bitwuzla"]:
             if self.noincr:
@@ -209,9 +683,7 @@ class SmtIo:
             else:
                 self.popen_vargs = [self.solver, '--smt2', '-i'] + self.solver_opts
             self.unroll = True
-            if self.timeout != 0:
-                print('timeout option is not supported for %s.' % self.solver)
-                sys.exit(1)
+            self.timeout_kill = self.timeout != 0
 
         if self.solver == "abc":
             if len(self.solver_opts) > 0:
@@ -221,9 +693,14 @@ class SmtIo:
             self.logic_ax = False
             self.unroll = True
             self.noincr = True
-            if self.timeout != 0:
-                print('timeout option is not supported for abc.')
+            self.timeout_kill = self.timeout != 0
+
+        if self.cache_dir is not None:
+            if self.solver == "dummy" or self.dummy_file is not None or self.forall:
+                print("Result cache is not supported with the dummy solver, --dummy, or exists-forall problems.")
                 sys.exit(1)
+            # the cache key covers the solver command line and every statement
+            self.cache_hash = hashlib.sha256(bytes(repr(self.popen_vargs), "utf-8"))
 
         if self.solver == "dummy":
             assert self.dummy_file is not None
@@ -231,9 +708,15 @@ class SmtIo:
         else:
             if self.dummy_file is not None:
                 self.dummy_fd = open(self.dummy_file, "w")
-            if not self.noincr:
+            # with a result cache the solver is only started on the first miss
+            if not self.noincr and self.cache_dir is None:
                 self.p_open()
 
+        # the model of an unrolled problem doesn't have the functions that
+        # the queries use, so all of them would end up as get-value anyway
+        if self.unroll:
+            self.modeleval = False
+
         if self.unroll:
             assert not self.forall
             self.logic_uf = False
@@ -244,6 +727,7 @@ class SmtIo:
             self.unroll_decls = dict()
             self.unroll_cache = dict()
             self.unroll_stack = list()
+            self.unroll_log = list()
 
         if self.logic is None:
             self.logic = ""
@@ -257,7 +741,7 @@ class SmtIo:
         self.setup_done = True
 
         for stmt in self.info_stmts:
-            self.write(stmt)
+            self.write(stmt, info=False)
 
         if self.produce_models:
             self.write("(set-option :produce-models true)")
@@ -277,85 +761,733 @@ class SmtIo:
             if key not in modestart_options:
                 self.write("(set-option {} {})".format(key, val))
 
-    def timestamp(self):
-        secs = int(time() - self.start_time)
-        return "## %3d:%02d:%02d " % (secs // (60*60), (secs // 60) % 60, secs % 60)
+    def portfolio_setup(self):
+        if os.name != "posix":
+            print("Solver portfolio mode is not supported on this platform.")
+            sys.exit(1)
+        if self.forall:
+            print("Solver portfolio mode is not supported for exists-forall problems.")
+            sys.exit(1)
+        if self.cache_dir is not None:
+            print("Solver portfolio mode is not supported with --cache.")
+            sys.exit(1)
 
-    def replace_in_stmt(self, stmt, pat, repl):
-        if stmt == pat:
-            return repl
+        # the member solvers do all unrolling and restarting themselves,
+        # here we only keep the current assertion stack for resyncing them
+        self.portfolio_unroll = self.unroll
+        self.portfolio_noincr = self.noincr
+        self.unroll = False
+        self.noincr = False
+        self.portfolio = list()
+        self.portfolio_stats = list()
+        self.portfolio_winner = None
+        self.portfolio_result = None
+
+        # the stats are per member, the same solver may be listed twice
+        # with different command line arguments after its name
+        for index, member in enumerate(self.solver[len("portfolio:"):].split(",")):
+            fields = member.split()
+            if len(fields) == 0:
+                print("Empty solver name in portfolio: %s" % self.solver)
+                sys.exit(1)
+            self.portfolio_stats.append([" ".join(fields), 0, 0, 0, 0.0])
+            self.portfolio.append(self.portfolio_member(fields[0], fields[1:], index))
 
-        if isinstance(stmt, list):
-            return [self.replace_in_stmt(s, pat, repl) for s in stmt]
+        self.setup_done = True
 
-        return stmt
+    def portfolio_member(self, solver, solver_opts, index):
+        m = SmtIo()
+        m.solver = solver
+        m.solver_opts = list(solver_opts)
+        m.portfolio_index = index
+        m.logic = self.logic
+        m.timeout = self.timeout
+        m.unroll = self.portfolio_unroll
+        m.noincr = self.portfolio_noincr
+        m.nocomments = self.nocomments
+        m.timeinfo = False
+        m.produce_models = self.produce_models
+        m.warm_pool_size = self.warm_pool_size
+        m.portfolio_pending = 0
+        m.portfolio_backlog = list()
+        m.portfolio_start = None
 
-    def unroll_stmt(self, stmt):
-        if not isinstance(stmt, list):
-            return stmt
+        for stmt in self.info_stmts:
+            m.write(stmt)
+        for i, cache_ctx in enumerate(self.smt2cache):
+            if i > 0:
+                m.write("(push 1)")
+            for cache_stmt in cache_ctx:
+                m.write(cache_stmt)
+        return m
+
+    def portfolio_drop(self, m, reason):
+        print("%s Dropping solver %d (%s) from portfolio: %s" % (self.timestamp(), m.portfolio_index, self.portfolio_stats[m.portfolio_index][0], reason), flush=True)
+        m.warm_close()
+        if m.p is not None:
+            m.p_kill()
+        self.portfolio_retire(m)
+        self.portfolio.remove(m)
+
+    def portfolio_retire(self, m):
+        # keep the I/O counters of members that are going away
+        self.p_bytes_written += m.p_bytes_written
+        self.p_blocked += m.p_blocked
+        self.p_flushes += m.p_flushes
+
+    def portfolio_write(self, stmt):
+        if stmt.startswith("(get-"):
+            assert self.portfolio_winner is not None
+            self.portfolio_winner.write(stmt)
+            return
+
+        if stmt == "(push 1)":
+            self.smt2cache.append(list())
+        elif stmt == "(pop 1)":
+            self.smt2cache.pop()
+        elif stmt != "(exit)":
+            self.smt2cache[-1].append(stmt)
+
+        for m in self.portfolio:
+            if m.portfolio_pending:
+                m.portfolio_backlog.append(stmt)
+            else:
+                m.write(stmt)
+
+    def portfolio_check_sat_start(self):
+        self.portfolio_winner = None
+        self.portfolio_result = None
+        self.portfolio_fallback = None
+        self.portfolio_racing = list()
+        self.portfolio_selector = selectors.DefaultSelector()
+
+        for i, m in enumerate(self.portfolio):
+            if m.portfolio_pending:
+                # a laggard from the previous race: if it has answered by
+                # now replay what we held back, otherwise restart it
+                if m.p is not None and not m.p_poll(0):
+                    m.p_read()
+                    m.portfolio_pending = 0
+                if m.portfolio_pending or not m.p_running:
+                    m.warm_close()
+                    if m.p is not None:
+                        m.p_kill()
+                    self.portfolio_retire(m)
+                    m = self.portfolio[i] = self.portfolio_member(m.solver, m.solver_opts, m.portfolio_index)
+                else:
+                    for stmt in m.portfolio_backlog:
+                        m.write(stmt)
+                m.portfolio_backlog = list()
+
+            m.check_sat_cmd = self.check_sat_cmd
+            m.check_sat_start()
+            m.portfolio_pending = 1
+            m.portfolio_start = time()
+            self.portfolio_stats[m.portfolio_index][1] += 1
+            self.portfolio_racing.append(m)
+            self.portfolio_selector.register(m.p.stdout, selectors.EVENT_READ)
+
+    def portfolio_poll(self, timeout=0.1):
+        deadline = time() + timeout
+        while self.portfolio_result is None:
+            for m in list(self.portfolio_racing):
+                if m.p_poll(0):
+                    continue
+
+                result = m.p_read()
+                m.portfolio_pending = 0
+                self.portfolio_racing.remove(m)
+                self.portfolio_selector.unregister(m.p.stdout)
+
+                if result in ["sat", "unsat", "unknown", "timeout", "interrupted"]:
+                    self.portfolio_stats[m.portfolio_index][3] += 1
+                    self.portfolio_stats[m.portfolio_index][4] += time() - m.portfolio_start
+                    if result in ["sat", "unsat"]:
+                        self.portfolio_stats[m.portfolio_index][2] += 1
+                        self.portfolio_winner = m
+                        self.portfolio_result = result
+                        break
+                    if self.portfolio_winner is None:
+                        self.portfolio_winner = m
+                        self.portfolio_fallback = result
+                else:
+                    self.portfolio_drop(m, "unexpected response: %s" % (result if result != "" else "EOF"))
+                    if len(self.portfolio) == 0:
+                        self.portfolio_result = result
 
-        stmt = [self.unroll_stmt(s) for s in stmt]
+            if self.portfolio_result is None and len(self.portfolio_racing) == 0:
+                self.portfolio_result = self.portfolio_fallback
 
-        if len(stmt) >= 2 and not isinstance(stmt[0], list) and stmt[0] in self.unroll_decls:
-            assert stmt[1] in self.unroll_objs
+            if self.portfolio_result is not None:
+                break
 
-            key = tuple(stmt)
-            if key not in self.unroll_cache:
-                decl = copy(self.unroll_decls[key[0]])
+            if self.timeout_deadline is not None and time() >= self.timeout_deadline:
+                # out of time, the members still racing are restarted by
+                # the next check-sat like any other laggard
+                for m in self.portfolio_racing:
+                    self.portfolio_selector.unregister(m.p.stdout)
+                    m.p_kill(signal.SIGKILL)
+                self.portfolio_racing = list()
+                self.portfolio_winner = None
+                self.portfolio_result = "timeout"
+                break
 
-                self.unroll_cache[key] = "|UNROLL#%d|" % self.unroll_idcnt
-                decl[1] = self.unroll_cache[key]
-                self.unroll_idcnt += 1
+            remaining = deadline - time()
+            if remaining <= 0:
+                return True
+            if self.timeout_deadline is not None:
+                remaining = min(remaining, self.timeout_deadline - time())
+            start = time()
+            self.portfolio_selector.select(remaining)
+            self.p_blocked += time() - start
+
+        if self.portfolio_selector is not None:
+            self.portfolio_selector.close()
+            self.portfolio_selector = None
+        return False
+
+    def portfolio_read(self):
+        if self.portfolio_result is not None:
+            result = self.portfolio_result
+            self.portfolio_result = None
+            return result
+        assert self.portfolio_winner is not None
+        return self.portfolio_winner.p_read()
+
+    def portfolio_report(self):
+        for index, (solver, checks, wins, answers, answer_time) in enumerate(self.portfolio_stats):
+            msg = "won %d of %d checks" % (wins, checks)
+            if answers > 0:
+                msg += ", average answer time %.3f seconds" % (answer_time / answers)
+            print("%s Portfolio solver %d (%s): %s." % (self.timestamp(), index, solver, msg), flush=True)
+
+    def cache_start(self):
+        # start the solver that was held back and send it everything so far
+        if self.noincr or self.p is not None:
+            return
+        self.timeout_killed = False
+        self.p_open()
+        self.p_replay()
+        if not self.timeout_kill:
+            self.smt2cache = [list() for cache_ctx in self.smt2cache]
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def cache_write(self, stmt):
+        # returns True if the statement has been answered from the cache
+        self.cache_hash.update(bytes(stmt + "\n", "utf-8"))
+
+        if not stmt.startswith("(get-"):
+            # new definitions (e.g. from --unroll) keep the model intact
+            if not stmt.startswith(("(define-", "(declare-")):
+                self.cache_finish()
+            return False
 
-                if decl[0] == "declare-fun":
-                    if isinstance(decl[3], list) or decl[3] not in self.unroll_sorts:
-                        self.unroll_objs.add(decl[1])
-                        decl[2] = list()
-                    else:
-                        self.unroll_objs.add(decl[1])
-                        decl = list()
+        if self.cache_entry is not None and stmt in self.cache_entry["answers"]:
+            self.cache_answer = self.cache_entry["answers"][stmt]
+            return True
+
+        # not cached: the solver has to catch up with the cached check first
+        self.cache_start()
+        if not self.cache_checked:
+            self.cache_checked = True
+            self.check_sat_start()
+            self.read()
+        if self.cache_entry is not None:
+            self.cache_query = stmt
+        return False
+
+    def cache_lookup(self):
+        self.cache_finish()
+        self.cache_hash.update(bytes(self.check_sat_cmd + "\n", "utf-8"))
+        key = self.cache_hash.hexdigest()
 
-                elif decl[0] == "define-fun":
-                    arg_index = 1
-                    for arg_name, arg_sort in decl[2]:
-                        decl[4] = self.replace_in_stmt(decl[4], arg_name, key[arg_index])
-                        arg_index += 1
-                    decl[2] = list()
+        try:
+            with open(self.cache_path(key), "r") as f:
+                entry = json.load(f)
+            os.utime(self.cache_path(key))
+        except (OSError, ValueError):
+            self.cache_misses += 1
+            self.cache_entry = {"key": key, "result": None, "answers": dict(), "dirty": False}
+            self.cache_start()
+            return None
 
-                if len(decl) > 0:
-                    decl = self.unroll_stmt(decl)
-                    self.write(self.unparse(decl), unroll=False)
+        self.cache_hits += 1
+        self.cache_entry = {"key": key, "result": entry["result"], "answers": entry["answers"], "dirty": False}
+        self.cache_checked = False
+        return entry["result"]
 
-            return self.unroll_cache[key]
+    def cache_store(self, result):
+        self.cache_checked = True
+        if result in ["sat", "unsat"]:
+            self.cache_entry["result"] = result
+            self.cache_entry["dirty"] = True
+        else:
+            self.cache_entry = None
 
-        return stmt
+    def cache_finish(self):
+        entry = self.cache_entry
+        self.cache_entry = None
+        if entry is None or not entry["dirty"]:
+            return
+        path = self.cache_path(entry["key"])
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".%d.tmp" % os.getpid(), "w") as f:
+                json.dump({"result": entry["result"], "answers": entry["answers"]}, f)
+            os.replace(path + ".%d.tmp" % os.getpid(), path)
+        except OSError as e:
+            print("%s Can't write result cache entry %s: %s" % (self.timestamp(), path, e), flush=True)
+
+    def cache_evict(self, cache_dir, cache_size):
+        # drop the least recently used entries until the cache fits
+        entries = list()
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(cache_dir):
+            for filename in filenames:
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(dirpath, filename)))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= cache_size * 1024 * 1024:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def cache_report(self):
+        print("%s Result cache: %d hits, %d misses." % (self.timestamp(), self.cache_hits, self.cache_misses), flush=True)
+
+    def stats_snapshot(self):
+        sent = self.p_bytes_written
+        blocked = self.p_blocked
+        if self.portfolio is not None:
+            for m in self.portfolio:
+                sent += m.p_bytes_written
+                blocked += m.p_blocked
+        return (time(), blocked, sent, self.p_bytes_read, self.stats_stmts, self.stats_phase)
+
+    def stats_record(self, kind, start, extra):
+        end = self.stats_snapshot()
+        wall = end[0] - start[0]
+        blocked = end[1] - start[1]
+        phase = ("setup", None) if start[5] is None else start[5]
+        event = {
+            "kind": kind,
+            "phase": phase[0],
+            "step": phase[1],
+            "wall": wall,
+            "blocked": blocked,
+            "python": wall - blocked,
+            "bytes_sent": end[2] - start[2],
+            "bytes_received": end[3] - start[3],
+            "stmts": end[4] - start[4],
+        }
+        event.update(extra)
+        self.stats.append(event)
+
+    def stats_start(self):
+        # a check or query ends the current write burst
+        if self.stats is None or self.stats_busy:
+            return None
+        if self.stats_burst is not None:
+            self.stats_record("write", self.stats_burst, dict())
+            self.stats_burst = None
+        self.stats_busy = True
+        return self.stats_snapshot()
+
+    def stats_end(self, kind, start, **extra):
+        if start is None:
+            return
+        self.stats_busy = False
+        self.stats_record(kind, start, extra)
+
+    def stats_report(self):
+        if self.stats_burst is not None:
+            self.stats_record("write", self.stats_burst, dict())
+            self.stats_burst = None
+
+        fields = ["wall", "blocked", "python", "bytes_sent", "bytes_received", "stmts"]
+
+        def add(totals, event):
+            for field in fields:
+                totals[field] += event[field]
+            totals["count"] += 1
+
+        def empty():
+            totals = dict((field, 0) for field in fields)
+            totals["count"] = 0
+            return totals
+
+        totals = dict()
+        steps = dict()
+        for event in self.stats:
+            add(totals.setdefault(event["kind"], empty()), event)
+            key = (event["phase"], event["step"])
+            if key not in steps:
+                steps[key] = {"phase": event["phase"], "step": event["step"], "totals": dict()}
+            add(steps[key]["totals"].setdefault(event["kind"], empty()), event)
+
+        return {
+            "solver": self.solver,
+            "totals": totals,
+            "steps": list(steps.values()),
+            "events": self.stats,
+        }
+
+    def timestamp(self):
+        secs = int(time() - self.start_time)
+        return "## %3d:%02d:%02d " % (secs // (60*60), (secs // 60) % 60, secs % 60)
+
+    def unroll_add(self, container, key, value=None):
+        # sets are updated with value=None, dicts with a value. Within a
+        # (push 1) every change is logged so (pop 1) can revert just those.
+        if len(self.unroll_stack) > 0:
+            if key not in container:
+                self.unroll_log.append((container, key, False, None))
+            elif value is not None:
+                self.unroll_log.append((container, key, True, container[key]))
+        if value is None:
+            container.add(key)
+        else:
+            container[key] = value
+
+    def unroll_undo(self, mark):
+        while len(self.unroll_log) > mark:
+            container, key, existed, value = self.unroll_log.pop()
+            if existed:
+                container[key] = value
+            elif isinstance(container, set):
+                container.remove(key)
+            else:
+                del container[key]
+
+    def unroll_app(self, head, args):
+        assert args[0] in self.unroll_objs
+
+        key = (head,) + tuple(args)
+        if key not in self.unroll_cache:
+            kind, params, ret, body = self.unroll_decls[head]
+            name = "|UNROLL#%d|" % self.unroll_idcnt
+            self.unroll_add(self.unroll_cache, key, name)
+            self.unroll_idcnt += 1
+
+            if kind == "declare-fun":
+                self.unroll_add(self.unroll_objs, name)
+                if isinstance(ret, list) or ret not in self.unroll_sorts:
+                    self.write("(declare-fun %s () %s)" % (name, self.unparse(ret)), unroll=False)
+
+            elif kind == "define-fun":
+                body = self.unroll_text(body, dict(zip(params, args)))
+                self.write("(define-fun %s () %s %s)" % (name, ret, body), unroll=False)
+
+        return self.unroll_cache[key]
+
+    def unroll_text(self, text, subst=None):
+        # Replace all applications of functions in unroll_decls (and all
+        # symbols in subst) in a single pass over the tokens of text. All
+        # other text is copied unchanged.
+        decls = self.unroll_decls
+        pieces = []
+        cursor = 0
+        stack = []
+        opening = None
+
+        for match in smt2_token_regex.finditer(text):
+            token = match.group()
+
+            if opening is not None:
+                if token in decls:
+                    stack.append([opening.start(), token, []])
+                    opening = None
+                    continue
+                assert len(stack) == 0 or stack[-1] is None
+                stack.append(None)
+                opening = None
+
+            if token == "(":
+                opening = match
+
+            elif token == ")":
+                app = stack.pop()
+                if app is None:
+                    continue
+                name = self.unroll_app(app[1], app[2])
+                if len(stack) != 0 and stack[-1] is not None:
+                    stack[-1][2].append(name)
+                else:
+                    pieces.append(text[cursor:app[0]])
+                    pieces.append(name)
+                    cursor = match.end()
+
+            else:
+                if subst is not None and token in subst:
+                    token = subst[token]
+                    if len(stack) == 0 or stack[-1] is None:
+                        pieces.append(text[cursor:match.start()])
+                        pieces.append(token)
+                        cursor = match.end()
+                        continue
+                if len(stack) != 0 and stack[-1] is not None:
+                    stack[-1][2].append(token)
+
+        if cursor == 0:
+            return text
+        pieces.append(text[cursor:])
+        return "".join(pieces)
 
     def p_thread_main(self):
+        stmt = []
+        count_brackets = 0
         while True:
-            data = self.p.stdout.readline().decode("ascii")
-            if data == "": break
-            self.p_queue.put(data)
+            line = self.p.stdout.readline().decode("ascii")
+            if line == "": break
+            if len(stmt) == 0 and line.strip() == "": continue
+            count_brackets += line.count("(")
+            count_brackets -= line.count(")")
+            stmt.append(line)
+            if count_brackets == 0:
+                self.p_queue.put("".join(stmt).strip())
+                stmt = []
+        if len(stmt) != 0:
+            self.p_queue.put("".join(stmt).strip())
         self.p_queue.put("")
         self.p_running = False
 
-    def p_open(self):
-        assert self.p is None
+    def p_own_group(self):
+        # a solver that is killed on a timeout gets its own process group,
+        # so that we can take down anything it spawned without hitting us
+        # as well. all other solvers stay in our group, so that whoever
+        # kills that group also stops them.
+        return os.name == "posix" and self.timeout_kill
+
+    def p_spawn(self):
         try:
-            self.p = subprocess.Popen(self.popen_vargs, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            return subprocess.Popen(self.popen_vargs, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    start_new_session=self.p_own_group())
         except FileNotFoundError:
             print("%s SMT Solver '%s' not found in path." % (self.timestamp(), self.popen_vargs[0]), flush=True)
             sys.exit(1)
+
+    def p_open(self, p=None):
+        assert self.p is None
+        self.p = self.p_spawn() if p is None else p
         running_solvers[self.p_index] = self.p
         self.p_running = True
         self.p_next = None
-        self.p_queue = Queue()
-        self.p_thread = Thread(target=self.p_thread_main)
-        self.p_thread.start()
+        if os.name == "posix":
+            # non-blocking pipes multiplexed with a selector, output is
+            # collected in p_buffer and split into complete statements there
+            os.set_blocking(self.p.stdin.fileno(), False)
+            os.set_blocking(self.p.stdout.fileno(), False)
+            self.p_selector = selectors.DefaultSelector()
+            self.p_selector.register(self.p.stdout, selectors.EVENT_READ)
+            self.p_buffer = bytearray()
+            self.p_wbuffer = bytearray()
+            self.p_scan_pos = 0
+            self.p_scan_depth = 0
+        else:
+            # selectors do not support pipes on Windows, use a reader thread
+            self.p_selector = None
+            self.p_queue = Queue()
+            self.p_thread = Thread(target=self.p_thread_main)
+            self.p_thread.start()
+
+    def p_fill(self):
+        fd = self.p.stdout.fileno()
+        while True:
+            try:
+                data = os.read(fd, 1024 * 1024)
+            except BlockingIOError:
+                return
+            if len(data) == 0:
+                self.p_selector.unregister(self.p.stdout)
+                self.p_running = False
+                return
+            self.p_buffer += data
+
+    def p_select(self, timeout=None):
+        if not self.p_running:
+            return False
+        start = time()
+        events = self.p_selector.select(timeout)
+        self.p_blocked += time() - start
+        for key, events in events:
+            if key.fileobj is self.p.stdout:
+                self.p_fill()
+                return True
+        return False
+
+    def p_extract(self):
+        buf = self.p_buffer
+        while True:
+            eol = buf.find(b"\n", self.p_scan_pos)
+            if eol < 0:
+                if self.p_running or len(buf.strip()) == 0:
+                    return None
+                eol = len(buf)
+            self.p_scan_depth += buf.count(b"(", self.p_scan_pos, eol)
+            self.p_scan_depth -= buf.count(b")", self.p_scan_pos, eol)
+            self.p_scan_pos = eol + 1
+            if self.p_scan_depth == 0 or eol == len(buf):
+                stmt = bytes(buf[:eol]).strip()
+                del buf[:eol+1]
+                self.p_scan_pos = 0
+                self.p_scan_depth = 0
+                if len(stmt) != 0:
+                    return stmt.decode("ascii")
 
     def p_write(self, data, flush):
         assert self.p is not None
-        self.p.stdin.write(bytes(data, "ascii"))
-        if flush: self.p.stdin.flush()
+        data = bytes(data, "ascii")
+        self.p_bytes_written += len(data)
+        if self.p_selector is None:
+            self.p.stdin.write(data)
+            if flush:
+                self.p.stdin.flush()
+                self.p_flushes += 1
+            return
+        self.p_wbuffer += data
+        if flush or len(self.p_wbuffer) >= 64 * 1024:
+            self.p_flush()
+
+    def p_flush(self):
+        if len(self.p_wbuffer) == 0:
+            return
+        self.p_flushes += 1
+        fd = self.p.stdin.fileno()
+        data = memoryview(self.p_wbuffer)
+        cursor = 0
+        waiting = False
+        while cursor < len(data):
+            try:
+                cursor += os.write(fd, data[cursor:])
+                continue
+            except BlockingIOError:
+                pass
+            # keep reading solver output while the input pipe is full,
+            # otherwise we deadlock if the solver blocks on a full stdout
+            if not waiting:
+                self.p_selector.register(self.p.stdin, selectors.EVENT_WRITE)
+                waiting = True
+            start = time()
+            events = self.p_selector.select()
+            self.p_blocked += time() - start
+            for key, events in events:
+                if key.fileobj is self.p.stdout:
+                    self.p_fill()
+        if waiting:
+            self.p_selector.unregister(self.p.stdin)
+        data.release()
+        del self.p_wbuffer[:]
+
+    def warm_prime(self, p, prefix, output):
+        # same loop as p_flush(): the solver output is collected in output
+        # while we write, otherwise a solver that prints something (e.g. an
+        # error) would block on a full stdout pipe and never read the rest
+        data = memoryview(bytes("".join(cache_stmt + "\n" for cache_ctx, count in prefix for cache_stmt in cache_ctx[:count]), "ascii"))
+        os.set_blocking(p.stdin.fileno(), False)
+        os.set_blocking(p.stdout.fileno(), False)
+        selector = selectors.DefaultSelector()
+        selector.register(p.stdin, selectors.EVENT_WRITE)
+        selector.register(p.stdout, selectors.EVENT_READ)
+        cursor = 0
+        try:
+            while cursor < len(data):
+                for key, events in selector.select():
+                    try:
+                        if key.fileobj is p.stdout:
+                            chunk = os.read(p.stdout.fileno(), 1024 * 1024)
+                            if len(chunk) == 0:
+                                # the solver is going away, warm_open() drops it
+                                p.wait()
+                                return
+                            output += chunk
+                        else:
+                            cursor += os.write(p.stdin.fileno(), data[cursor:])
+                    except BlockingIOError:
+                        pass
+        except BrokenPipeError:
+            pass
+        finally:
+            selector.close()
+            data.release()
+
+    def warm_spawn(self):
+        global solvers_index
+
+        # only the outer contexts are loaded, the innermost one is usually
+        # popped right after the check that is running now
+        prefix = [(cache_ctx, len(cache_ctx)) for cache_ctx in self.smt2cache[:-1]]
+        if len(self.smt2cache) == 1:
+            prefix = [(self.smt2cache[0], len(self.smt2cache[0]))]
+
+        p = self.p_spawn()
+        key = solvers_index
+        solvers_index += 1
+        running_solvers[key] = p
+        output = bytearray()
+        if os.name == "posix":
+            thread = Thread(target=self.warm_prime, args=(p, prefix, output))
+            thread.start()
+        else:
+            # selectors do not support pipes on Windows, so the solver only
+            # gets its input once it is used and its reader thread runs
+            prefix = [(cache_ctx, 0) for cache_ctx, count in prefix]
+            thread = None
+        self.warm_pool.append((p, key, prefix, thread, output))
+
+    def warm_open(self):
+        while len(self.warm_pool) > 0:
+            p, key, prefix, thread, output = self.warm_pool.pop(0)
+            if thread is not None:
+                thread.join()
+            del running_solvers[key]
+
+            # the process can be used if the contexts it was primed with are
+            # still on the stack, i.e. its input is a prefix of smt2cache
+            valid = p.poll() is None and len(prefix) <= len(self.smt2cache)
+            valid = valid and all(self.smt2cache[i] is cache_ctx for i, (cache_ctx, count) in enumerate(prefix))
+
+            if not valid:
+                os.kill(p.pid, signal.SIGTERM)
+                p.wait()
+                p.stdin.close()
+                p.stdout.close()
+                continue
+
+            self.p_open(p)
+            if len(output) != 0:
+                self.p_buffer += output
+            for cache_ctx, count in prefix:
+                for cache_stmt in cache_ctx[count:]:
+                    self.p_write(cache_stmt + "\n", False)
+            for cache_ctx in self.smt2cache[len(prefix):]:
+                for cache_stmt in cache_ctx:
+                    self.p_write(cache_stmt + "\n", False)
+            return
+
+        self.p_open()
+        for cache_ctx in self.smt2cache:
+            for cache_stmt in cache_ctx:
+                self.p_write(cache_stmt + "\n", False)
+
+    def warm_close(self):
+        for p, key, prefix, thread, output in self.warm_pool:
+            os.kill(p.pid, signal.SIGTERM)
+            if thread is not None:
+                thread.join()
+            p.wait()
+            del running_solvers[key]
+        self.warm_pool = list()
 
     def p_read(self):
         assert self.p is not None
@@ -363,35 +1495,99 @@ class SmtIo:
             data = self.p_next
             self.p_next = None
             return data
-        if not self.p_running:
-            return ""
-        return self.p_queue.get()
+        if self.p_selector is None:
+            if not self.p_running:
+                return ""
+            self.p.stdin.flush()
+            start = time()
+            data = self.p_queue.get()
+            self.p_blocked += time() - start
+            return data
+        self.p_flush()
+        while True:
+            data = self.p_extract()
+            if data is not None:
+                return data
+            if not self.p_running:
+                return ""
+            self.p_select()
 
     def p_poll(self, timeout=0.1):
         assert self.p is not None
-        assert self.p_running
-        if self.p_next is not None:
-            return False
-        try:
-            self.p_next = self.p_queue.get(True, timeout)
+        if self.p_next is not None or not self.p_running:
             return False
-        except Empty:
-            return True
+        if self.p_selector is None:
+            start = time()
+            try:
+                self.p_next = self.p_queue.get(True, timeout)
+                return False
+            except Empty:
+                return True
+            finally:
+                self.p_blocked += time() - start
+        deadline = time() + timeout
+        while True:
+            self.p_next = self.p_extract()
+            if self.p_next is not None or not self.p_running:
+                return False
+            remaining = deadline - time()
+            if not self.p_select(max(remaining, 0)) and remaining <= 0:
+                return True
 
     def p_close(self):
         assert self.p is not None
-        self.p.stdin.close()
-        self.p_thread.join()
+        if self.p_selector is None:
+            self.p.stdin.close()
+            self.p_thread.join()
+            self.p_queue = None
+            self.p_thread = None
+        else:
+            self.p_flush()
+            self.p.stdin.close()
+            while self.p_running:
+                self.p_select()
+            self.p_selector.close()
+            self.p_selector = None
+            self.p_buffer = None
+            self.p_wbuffer = None
         assert not self.p_running
         del running_solvers[self.p_index]
         self.p = None
         self.p_next = None
-        self.p_queue = None
-        self.p_thread = None
 
-    def write(self, stmt, unroll=True):
+    def p_kill(self, sig=signal.SIGTERM):
+        assert self.p is not None
+        try:
+            if self.p_own_group():
+                os.killpg(self.p.pid, sig)
+            else:
+                os.kill(self.p.pid, sig)
+        except ProcessLookupError:
+            pass
+        self.p.wait()
+        if self.p_selector is None:
+            self.p_thread.join()
+            self.p_queue = None
+            self.p_thread = None
+        else:
+            self.p_selector.close()
+            self.p_selector = None
+            self.p_buffer = None
+            self.p_wbuffer = None
+        try:
+            self.p.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.p.stdout.close()
+        self.p_running = False
+        del running_solvers[self.p_index]
+        self.p = None
+        self.p_next = None
+
+    def write(self, stmt, unroll=True, info=True):
         if stmt.startswith(";"):
-            self.info(stmt)
+            if info:
+                self.info(stmt)
             if not self.setup_done:
                 self.info_stmts.append(stmt)
                 return
@@ -400,10 +1596,18 @@ class SmtIo:
 
         stmt = stmt.strip()
 
+        if self.modeleval and (stmt.startswith("(") or self.modeleval_buffer != ""):
+            self.modeleval_record(stmt)
+
         if self.nocomments or self.unroll:
-            stmt = re.sub(r" *;.*", "", stmt)
+            if ";" in stmt:
+                stmt = re.sub(r" *;.*", "", stmt)
             if stmt == "": return
 
+        self.stats_stmts += 1
+        if self.stats is not None and self.stats_burst is None and not self.stats_busy:
+            self.stats_burst = self.stats_snapshot()
+
         if unroll and self.unroll:
             stmt = self.unroll_buffer + stmt
             self.unroll_buffer = ""
@@ -413,43 +1617,50 @@ class SmtIo:
                 self.unroll_buffer = stmt + " "
                 return
 
-            s = self.parse(stmt)
-
             if self.debug_print:
-                print("-> %s" % s)
+                print("-> %s" % stmt)
 
-            if len(s) == 3 and s[0] == "declare-sort" and s[2] == "0":
-                self.unroll_sorts.add(s[1])
-                return
+            kind = smt2_decl_regex.match(stmt)
+            kind = None if kind is None else kind.group(1)
 
-            elif len(s) == 4 and s[0] == "declare-fun" and s[2] == [] and s[3] in self.unroll_sorts:
-                self.unroll_objs.add(s[1])
-                return
+            if kind == "define-fun":
+                # only the header is parsed, the body is kept as text
+                header, body = self.parse_header(stmt, 4)
+                if len(header) == 4:
+                    for arg_name, arg_sort in header[2]:
+                        if arg_sort in self.unroll_sorts:
+                            params = [arg_name for arg_name, arg_sort in header[2]]
+                            self.unroll_add(self.unroll_decls, header[1], ("define-fun", params, self.unparse(header[3]), body))
+                            return
+
+            elif kind is not None:
+                s = self.parse(stmt)
 
-            elif len(s) >= 4 and s[0] == "declare-fun":
-                for arg_sort in s[2]:
-                    if arg_sort in self.unroll_sorts:
-                        self.unroll_decls[s[1]] = s
-                        return
+                if len(s) == 3 and s[0] == "declare-sort" and s[2] == "0":
+                    self.unroll_add(self.unroll_sorts, s[1])
+                    return
 
-            elif len(s) >= 4 and s[0] == "define-fun":
-                for arg_name, arg_sort in s[2]:
-                    if arg_sort in self.unroll_sorts:
-                        self.unroll_decls[s[1]] = s
-                        return
+                elif len(s) == 4 and s[0] == "declare-fun" and s[2] == [] and s[3] in self.unroll_sorts:
+                    self.unroll_add(self.unroll_objs, s[1])
+                    return
 
-            stmt = self.unparse(self.unroll_stmt(s))
+                elif len(s) >= 4 and s[0] == "declare-fun":
+                    for arg_sort in s[2]:
+                        if arg_sort in self.unroll_sorts:
+                            self.unroll_add(self.unroll_decls, s[1], ("declare-fun", None, s[3], None))
+                            return
+
+            if not self.unroll_decls.keys().isdisjoint(smt2_token_regex.findall(stmt)):
+                stmt = self.unroll_text(stmt)
 
             if stmt == "(push 1)":
-                self.unroll_stack.append((
-                    copy(self.unroll_sorts),
-                    copy(self.unroll_objs),
-                    copy(self.unroll_decls),
-                    copy(self.unroll_cache),
-                ))
+                self.unroll_stack.append(len(self.unroll_log))
 
             if stmt == "(pop 1)":
-                self.unroll_sorts, self.unroll_objs, self.unroll_decls, self.unroll_cache = self.unroll_stack.pop()
+                self.unroll_undo(self.unroll_stack.pop())
+
+        if self.prep_record is not None:
+            self.prep_record.append(stmt)
 
         if self.debug_print:
             print("> %s" % stmt)
@@ -458,7 +1669,12 @@ class SmtIo:
             print(stmt, file=self.debug_file)
             self.debug_file.flush()
 
-        if self.solver != "dummy":
+        if self.cache_dir is not None and self.cache_write(stmt):
+            return
+
+        if self.portfolio is not None:
+            self.portfolio_write(stmt)
+        elif self.solver != "dummy":
             if self.noincr:
                 if self.p is not None and not stmt.startswith("(get-"):
                     self.p_close()
@@ -470,226 +1686,496 @@ class SmtIo:
                     if self.p is not None:
                         self.p_write(stmt + "\n", True)
                     self.smt2cache[-1].append(stmt)
+            elif self.cache_dir is not None and self.p is None:
+                # solver held back by the result cache, see cache_start()
+                if stmt == "(push 1)":
+                    self.smt2cache.append(list())
+                elif stmt == "(pop 1)":
+                    self.smt2cache.pop()
+                else:
+                    self.smt2cache[-1].append(stmt)
             else:
-                self.p_write(stmt + "\n", True)
+                if self.timeout_kill:
+                    # keep the session around, the solver is killed on a timeout
+                    if self.timeout_killed:
+                        if stmt == "(exit)":
+                            return
+                        self.timeout_restart()
+                    if stmt == "(push 1)":
+                        self.smt2cache.append(list())
+                    elif stmt == "(pop 1)":
+                        self.smt2cache.pop()
+                    elif not stmt.startswith("(get-"):
+                        self.smt2cache[-1].append(stmt)
+                # statements are only pushed to the solver when we are going
+                # to wait for its answer (or when the write buffer is full)
+                self.p_write(stmt + "\n", stmt.startswith(("(check-sat", "(get-", "(exit")))
 
     def info(self, stmt):
         if not stmt.startswith("; yosys-smt2-"):
             return
 
+        self.hierindex_cache.clear()
         fields = stmt.split()
 
-        if fields[1] == "yosys-smt2-solver-option":
-            self.smt2_options[fields[2]] = fields[3]
+        handler = self.info_handlers.get(fields[1])
+        if handler is not None:
+            handler(self, fields)
 
-        if fields[1] == "yosys-smt2-nomem":
-            if self.logic is None:
-                self.logic_ax = False
+    def info_solver_option(self, fields):
+        self.smt2_options[fields[2]] = fields[3]
 
-        if fields[1] == "yosys-smt2-nobv":
-            if self.logic is None:
-                self.logic_bv = False
+    def info_nomem(self, fields):
+        if self.logic is None:
+            self.logic_ax = False
 
-        if fields[1] == "yosys-smt2-stdt":
-            if self.logic is None:
-                self.logic_dt = True
+    def info_nobv(self, fields):
+        if self.logic is None:
+            self.logic_bv = False
 
-        if fields[1] == "yosys-smt2-forall":
-            if self.logic is None:
-                self.logic_qf = False
-            self.forall = True
+    def info_stdt(self, fields):
+        if self.logic is None:
+            self.logic_dt = True
+
+    def info_forall(self, fields):
+        if self.logic is None:
+            self.logic_qf = False
+        self.forall = True
 
-        if fields[1] == "yosys-smt2-module":
-            self.curmod = fields[2]
-            self.modinfo[self.curmod] = SmtModInfo()
+    def info_module(self, fields):
+        self.curmod = sys.intern(fields[2])
+        self.modinfo[self.curmod] = SmtModInfo()
 
-        if fields[1] == "yosys-smt2-cell":
-            self.modinfo[self.curmod].cells[fields[3]] = fields[2]
+    def info_cell(self, fields):
+        self.modinfo[self.curmod].cells[sys.intern(fields[3])] = sys.intern(fields[2])
 
-        if fields[1] == "yosys-smt2-topmod":
-            self.topmod = fields[2]
+    def info_topmod(self, fields):
+        self.topmod = fields[2]
 
-        if fields[1] == "yosys-smt2-input":
-            self.modinfo[self.curmod].inputs.add(fields[2])
-            self.modinfo[self.curmod].wsize[fields[2]] = int(fields[3])
+    def info_input(self, fields):
+        self.modinfo[self.curmod].add_net(fields[2], int(fields[3]), SmtModInfo.NET_INPUT)
 
-        if fields[1] == "yosys-smt2-output":
-            self.modinfo[self.curmod].outputs.add(fields[2])
-            self.modinfo[self.curmod].wsize[fields[2]] = int(fields[3])
+    def info_output(self, fields):
+        self.modinfo[self.curmod].add_net(fields[2], int(fields[3]), SmtModInfo.NET_OUTPUT)
 
-        if fields[1] == "yosys-smt2-register":
-            self.modinfo[self.curmod].registers.add(fields[2])
-            self.modinfo[self.curmod].wsize[fields[2]] = int(fields[3])
+    def info_register(self, fields):
+        self.modinfo[self.curmod].add_net(fields[2], int(fields[3]), SmtModInfo.NET_REGISTER)
 
-        if fields[1] == "yosys-smt2-memory":
-            self.modinfo[self.curmod].memories[fields[2]] = (int(fields[3]), int(fields[4]), int(fields[5]), int(fields[6]), fields[7] == "async")
+    def info_memory(self, fields):
+        self.modinfo[self.curmod].memories[sys.intern(fields[2])] = (int(fields[3]), int(fields[4]), int(fields[5]), int(fields[6]), fields[7] == "async")
 
-        if fields[1] == "yosys-smt2-wire":
-            self.modinfo[self.curmod].wires.add(fields[2])
-            self.modinfo[self.curmod].wsize[fields[2]] = int(fields[3])
+    def info_wire(self, fields):
+        self.modinfo[self.curmod].add_net(fields[2], int(fields[3]), SmtModInfo.NET_WIRE)
 
-        if fields[1] == "yosys-smt2-clock":
-            for edge in fields[3:]:
-                if fields[2] not in self.modinfo[self.curmod].clocks:
-                    self.modinfo[self.curmod].clocks[fields[2]] = edge
-                elif self.modinfo[self.curmod].clocks[fields[2]] != edge:
-                    self.modinfo[self.curmod].clocks[fields[2]] = "event"
+    def info_clock(self, fields):
+        net = sys.intern(fields[2])
+        for edge in fields[3:]:
+            if net not in self.modinfo[self.curmod].clocks:
+                self.modinfo[self.curmod].clocks[net] = sys.intern(edge)
+            elif self.modinfo[self.curmod].clocks[net] != edge:
+                self.modinfo[self.curmod].clocks[net] = "event"
 
-        if fields[1] == "yosys-smt2-assert":
-            if len(fields) > 4:
-                self.modinfo[self.curmod].asserts["%s_a %s" % (self.curmod, fields[2])] = f'{fields[4]} ({fields[3]})'
-            else:
-                self.modinfo[self.curmod].asserts["%s_a %s" % (self.curmod, fields[2])] = fields[3]
+    def info_assert(self, fields):
+        if len(fields) > 4:
+            self.modinfo[self.curmod].asserts["%s_a %s" % (self.curmod, fields[2])] = f'{fields[4]} ({fields[3]})'
+        else:
+            self.modinfo[self.curmod].asserts["%s_a %s" % (self.curmod, fields[2])] = fields[3]
+
+    def info_cover(self, fields):
+        if len(fields) > 4:
+            self.modinfo[self.curmod].covers["%s_c %s" % (self.curmod, fields[2])] = f'{fields[4]} ({fields[3]})'
+        else:
+            self.modinfo[self.curmod].covers["%s_c %s" % (self.curmod, fields[2])] = fields[3]
+
+    def info_maximize(self, fields):
+        self.modinfo[self.curmod].maximize.add(fields[2])
+
+    def info_minimize(self, fields):
+        self.modinfo[self.curmod].minimize.add(fields[2])
+
+    def info_anyconst(self, fields):
+        name = sys.intern(fields[2])
+        self.modinfo[self.curmod].anyconsts[name] = (fields[4], None if len(fields) <= 5 else fields[5])
+        self.modinfo[self.curmod].asize[name] = int(fields[3])
+
+    def info_anyseq(self, fields):
+        name = sys.intern(fields[2])
+        self.modinfo[self.curmod].anyseqs[name] = (fields[4], None if len(fields) <= 5 else fields[5])
+        self.modinfo[self.curmod].asize[name] = int(fields[3])
+
+    def info_allconst(self, fields):
+        name = sys.intern(fields[2])
+        self.modinfo[self.curmod].allconsts[name] = (fields[4], None if len(fields) <= 5 else fields[5])
+        self.modinfo[self.curmod].asize[name] = int(fields[3])
+
+    def info_allseq(self, fields):
+        name = sys.intern(fields[2])
+        self.modinfo[self.curmod].allseqs[name] = (fields[4], None if len(fields) <= 5 else fields[5])
+        self.modinfo[self.curmod].asize[name] = int(fields[3])
+
+    info_handlers = {
+        "yosys-smt2-solver-option": info_solver_option,
+        "yosys-smt2-nomem": info_nomem,
+        "yosys-smt2-nobv": info_nobv,
+        "yosys-smt2-stdt": info_stdt,
+        "yosys-smt2-forall": info_forall,
+        "yosys-smt2-module": info_module,
+        "yosys-smt2-cell": info_cell,
+        "yosys-smt2-topmod": info_topmod,
+        "yosys-smt2-input": info_input,
+        "yosys-smt2-output": info_output,
+        "yosys-smt2-register": info_register,
+        "yosys-smt2-memory": info_memory,
+        "yosys-smt2-wire": info_wire,
+        "yosys-smt2-clock": info_clock,
+        "yosys-smt2-assert": info_assert,
+        "yosys-smt2-cover": info_cover,
+        "yosys-smt2-maximize": info_maximize,
+        "yosys-smt2-minimize": info_minimize,
+        "yosys-smt2-anyconst": info_anyconst,
+        "yosys-smt2-anyseq": info_anyseq,
+        "yosys-smt2-allconst": info_allconst,
+        "yosys-smt2-allseq": info_allseq,
+    }
+
+    def load_meta(self, filename, smt2_filename):
+        # reads the JSON file from "write_smt2 -meta", which has the same
+        # information as the "; yosys-smt2-*" comments of smt2_filename
+        with open(filename, "r") as f:
+            meta = json.load(f)
+
+        if meta.get("version") != 2:
+            print("%s Unsupported metadata file %s." % (self.timestamp(), filename), flush=True)
+            sys.exit(1)
 
-        if fields[1] == "yosys-smt2-cover":
-            if len(fields) > 4:
-                self.modinfo[self.curmod].covers["%s_c %s" % (self.curmod, fields[2])] = f'{fields[4]} ({fields[3]})'
+        # a sidecar left over from another write_smt2 call would silently
+        # describe a different design, so it has to match the smt2 file
+        with open(smt2_filename, "rb") as f:
+            matching = os.fstat(f.fileno()).st_size == meta["smt2"]["size"]
+            if matching and meta["smt2"]["size"] != 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    matching = hashlib.sha1(data).hexdigest() == meta["smt2"]["sha1"]
+        if not matching:
+            print("%s Metadata file %s was not written together with %s." % (self.timestamp(), filename, smt2_filename), flush=True)
+            sys.exit(1)
+
+        if self.logic is None:
+            if "nobv" in meta["flags"]:
+                self.logic_bv = False
+            if "nomem" in meta["flags"]:
+                self.logic_ax = False
+            if "stdt" in meta["flags"]:
+                self.logic_dt = True
+            if "forall" in meta["flags"]:
+                self.logic_qf = False
+        if "forall" in meta["flags"]:
+            self.forall = True
+        self.smt2_options.update(meta["solver_options"])
+
+        for mod in meta["modules"]:
+            name = sys.intern(mod["name"])
+            info = self.modinfo[name] = SmtModInfo()
+            for cell, celltype in mod.get("cells", {}).items():
+                info.cells[sys.intern(cell)] = sys.intern(celltype)
+
+            nets = dict()
+            for key, kind in SmtModInfo.net_views.items():
+                for net, width in mod.get(key, {}).items():
+                    nets[net] = (width, nets[net][1] | kind if net in nets else kind)
+            for net, (width, kind) in nets.items():
+                info.add_net(net, width, kind)
+
+            for net, edges in mod.get("clocks", {}).items():
+                info.clocks[sys.intern(net)] = sys.intern(edges[0]) if len(edges) == 1 else "event"
+
+            for mem, (abits, width, rports, wports, kind) in mod.get("memories", {}).items():
+                info.memories[sys.intern(mem)] = (abits, width, rports, wports, kind == "async")
+
+            for key, postfix in [("asserts", "a"), ("covers", "c")]:
+                for prop_id, prop in mod.get(key, {}).items():
+                    src = prop[1].split() if len(prop) > 1 else []
+                    getattr(info, key)["%s_%s %s" % (name, postfix, prop_id)] = prop[0] if len(src) == 0 else "%s (%s)" % (src[0], prop[0])
+
+            for key in ["anyconsts", "anyseqs", "allconsts", "allseqs"]:
+                for var, (width, infostr) in mod.get(key, {}).items():
+                    infostr = infostr.split()
+                    var = sys.intern(var)
+                    getattr(info, key)[var] = (infostr[0], None if len(infostr) <= 1 else infostr[1])
+                    info.asize[var] = width
+
+            if "maximize" in mod:
+                info.maximize.update(mod["maximize"])
+            if "minimize" in mod:
+                info.minimize.update(mod["minimize"])
+
+        if meta["topmod"] is not None:
+            self.topmod = meta["topmod"]
+
+        self.hierindex_cache.clear()
+        if self.topmod is not None:
+            self.hierindex(self.topmod)
+
+    def load(self, filename, info=True):
+        # reads a write_smt2 file: metadata lines are picked out with one
+        # regex scan of the mapped file, the text itself goes to write() in
+        # large chunks instead of line by line. info=False skips the
+        # metadata, for use after load_meta()
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                data = b""
             else:
-                self.modinfo[self.curmod].covers["%s_c %s" % (self.curmod, fields[2])] = fields[3]
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # the header is needed for setup(), so it still goes line by line
+        pos = 0
+        while not self.setup_done and data[pos:pos + 1] == b";":
+            end = data.find(b"\n", pos)
+            if end < 0:
+                end = len(data)
+            self.write(data[pos:end].decode("ascii"), info=info)
+            pos = end + 1
+        if not self.setup_done:
+            self.setup()
 
-        if fields[1] == "yosys-smt2-maximize":
-            self.modinfo[self.curmod].maximize.add(fields[2])
+        prep_path = None
+        if self.prep_cache_dir is not None:
+            prep_path = self.prep_path(data)
+            if self.prep_restore(prep_path):
+                if not self.unroll:
+                    # only the metadata was cached, the text still goes out
+                    info = False
+                else:
+                    pos = len(data)
+                    prep_path = None
+            elif self.unroll:
+                self.prep_record = list()
+
+        # only lines with a handler are decoded and split
+        if info:
+            self.hierindex_cache.clear()
+            for match in smt2_info_regex.finditer(data, max(pos - 1, 0)):
+                handler = self.info_handlers.get(match.group(1).decode("ascii"))
+                if handler is not None:
+                    handler(self, match.group(0).decode("ascii").split())
+
+        # chunks end where a new top-level statement starts
+        while pos < len(data):
+            end = data.rfind(b"\n(", pos, pos + 1024 * 1024) + 1
+            if end <= pos:
+                end = data.find(b"\n(", pos + 1024 * 1024) + 1
+                if end <= 0:
+                    end = len(data)
+            self.load_text(data[pos:end].decode("ascii"))
+            pos = end
+
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+        if prep_path is not None:
+            self.prep_store(prep_path)
+
+    def prep_path(self, data):
+        key = hashlib.sha256(data)
+        key.update(bytes(repr((2, self.solver, self.logic, self.unroll, self.nocomments)), "utf-8"))
+        key = key.hexdigest()
+        return os.path.join(self.prep_cache_dir, key[:2], key + ".pickle")
+
+    def prep_restore(self, path):
+        # a broken or foreign entry is a miss, load() then overwrites it
+        try:
+            with open(path, "rb") as f:
+                prep = pickle.load(f)
+            modinfo = prep["modinfo"]
+            topmod = prep["topmod"]
+            stream = prep["stream"]
+            if stream is not None:
+                idcnt, sorts, objs, decls, cache = prep["unroll"]
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print("%s Can't read preprocessing cache entry %s: %s" % (self.timestamp(), path, e), flush=True)
+            return False
 
-        if fields[1] == "yosys-smt2-minimize":
-            self.modinfo[self.curmod].minimize.add(fields[2])
+        self.modinfo = modinfo
+        self.topmod = topmod
+        self.hierindex_cache.clear()
 
-        if fields[1] == "yosys-smt2-anyconst":
-            self.modinfo[self.curmod].anyconsts[fields[2]] = (fields[4], None if len(fields) <= 5 else fields[5])
-            self.modinfo[self.curmod].asize[fields[2]] = int(fields[3])
+        if stream is not None:
+            self.unroll_idcnt, self.unroll_sorts, self.unroll_objs, self.unroll_decls, self.unroll_cache = idcnt, sorts, objs, decls, cache
+            if stream != "":
+                self.write(stream, unroll=False, info=False)
+        return True
 
-        if fields[1] == "yosys-smt2-anyseq":
-            self.modinfo[self.curmod].anyseqs[fields[2]] = (fields[4], None if len(fields) <= 5 else fields[5])
-            self.modinfo[self.curmod].asize[fields[2]] = int(fields[3])
+    def prep_store(self, path):
+        prep = dict()
+        prep["modinfo"] = self.modinfo
+        prep["topmod"] = self.topmod
+        prep["stream"] = None
+
+        if self.prep_record is not None:
+            record = self.prep_record
+            self.prep_record = None
+            # the stream is replayed as a single write, which is only
+            # correct for plain declarations and definitions
+            for stmt in record:
+                if stmt.startswith(("(push", "(pop", "(check-sat", "(get-", "(exit")):
+                    return
+            prep["unroll"] = (self.unroll_idcnt, self.unroll_sorts, self.unroll_objs, self.unroll_decls, self.unroll_cache)
+            prep["stream"] = "\n".join(record)
 
-        if fields[1] == "yosys-smt2-allconst":
-            self.modinfo[self.curmod].allconsts[fields[2]] = (fields[4], None if len(fields) <= 5 else fields[5])
-            self.modinfo[self.curmod].asize[fields[2]] = int(fields[3])
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".%d.tmp" % os.getpid(), "wb") as f:
+                pickle.dump(prep, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".%d.tmp" % os.getpid(), path)
+        except OSError as e:
+            print("%s Can't write preprocessing cache entry %s: %s" % (self.timestamp(), path, e), flush=True)
+        self.cache_evict(self.prep_cache_dir, self.prep_cache_size)
+
+    def load_text(self, text):
+        if self.nocomments or self.unroll:
+            text = smt2_blank_regex.sub("\n", smt2_comment_regex.sub("", text))
 
-        if fields[1] == "yosys-smt2-allseq":
-            self.modinfo[self.curmod].allseqs[fields[2]] = (fields[4], None if len(fields) <= 5 else fields[5])
-            self.modinfo[self.curmod].asize[fields[2]] = int(fields[3])
+        if self.unroll:
+            # one statement per top-level paren, write() still joins them
+            # up if that guess was wrong
+            for stmt in smt2_stmt_regex.split(text):
+                stmt = stmt.strip()
+                if stmt != "":
+                    self.write(stmt.replace("\n", " "), info=False)
+
+        elif self.modeleval or self.portfolio is not None or smt2_control_regex.search(text):
+            for line in text.split("\n"):
+                if line != "":
+                    self.write(line, info=False)
+
+        elif text.strip() != "":
+            self.write(text, info=False)
+
+    def hierindex(self, top):
+        if top not in self.hierindex_cache:
+            self.hierindex_cache[top] = SmtHierIndex(self.modinfo, top)
+        return self.hierindex_cache[top]
 
     def hiernets(self, top, regs_only=False):
-        def hiernets_worker(nets, mod, cursor):
-            for netname in sorted(self.modinfo[mod].wsize.keys()):
-                if not regs_only or netname in self.modinfo[mod].registers:
-                    nets.append(cursor + [netname])
-            for cellname, celltype in sorted(self.modinfo[mod].cells.items()):
-                hiernets_worker(nets, celltype, cursor + [cellname])
-
-        nets = list()
-        hiernets_worker(nets, top, [])
-        return nets
+        index = self.hierindex(top)
+        return [list(path) for path in (index.hierregs if regs_only else index.hiernets)]
 
     def hieranyconsts(self, top):
-        def worker(results, mod, cursor):
-            for name, value in sorted(self.modinfo[mod].anyconsts.items()):
-                width = self.modinfo[mod].asize[name]
-                results.append((cursor, name, value[0], value[1], width))
-            for cellname, celltype in sorted(self.modinfo[mod].cells.items()):
-                worker(results, celltype, cursor + [cellname])
-
-        results = list()
-        worker(results, top, [])
-        return results
+        return [(list(item[0]),) + item[1:] for item in self.hierindex(top).hieranyconsts]
 
     def hieranyseqs(self, top):
-        def worker(results, mod, cursor):
-            for name, value in sorted(self.modinfo[mod].anyseqs.items()):
-                width = self.modinfo[mod].asize[name]
-                results.append((cursor, name, value[0], value[1], width))
-            for cellname, celltype in sorted(self.modinfo[mod].cells.items()):
-                worker(results, celltype, cursor + [cellname])
-
-        results = list()
-        worker(results, top, [])
-        return results
+        return [(list(item[0]),) + item[1:] for item in self.hierindex(top).hieranyseqs]
 
     def hierallconsts(self, top):
-        def worker(results, mod, cursor):
-            for name, value in sorted(self.modinfo[mod].allconsts.items()):
-                width = self.modinfo[mod].asize[name]
-                results.append((cursor, name, value[0], value[1], width))
-            for cellname, celltype in sorted(self.modinfo[mod].cells.items()):
-                worker(results, celltype, cursor + [cellname])
-
-        results = list()
-        worker(results, top, [])
-        return results
+        return [(list(item[0]),) + item[1:] for item in self.hierindex(top).hierallconsts]
 
     def hierallseqs(self, top):
-        def worker(results, mod, cursor):
-            for name, value in sorted(self.modinfo[mod].allseqs.items()):
-                width = self.modinfo[mod].asize[name]
-                results.append((cursor, name, value[0], value[1], width))
-            for cellname, celltype in sorted(self.modinfo[mod].cells.items()):
-                worker(results, celltype, cursor + [cellname])
-
-        results = list()
-        worker(results, top, [])
-        return results
+        return [(list(item[0]),) + item[1:] for item in self.hierindex(top).hierallseqs]
 
     def hiermems(self, top):
-        def hiermems_worker(mems, mod, cursor):
-            for memname in sorted(self.modinfo[mod].memories.keys()):
-                mems.append(cursor + [memname])
-            for cellname, celltype in sorted(self.modinfo[mod].cells.items()):
-                hiermems_worker(mems, celltype, cursor + [cellname])
-
-        mems = list()
-        hiermems_worker(mems, top, [])
-        return mems
+        return [list(path) for path in self.hierindex(top).hiermems]
 
     def read(self):
-        stmt = []
-        count_brackets = 0
+        if self.cache_answer is not None:
+            stmt = self.cache_answer
+            self.cache_answer = None
+            return stmt
 
-        while True:
-            if self.solver == "dummy":
+        if self.solver == "dummy":
+            stmt = []
+            count_brackets = 0
+
+            while True:
                 line = self.dummy_fd.readline().strip()
-            else:
-                line = self.p_read().strip()
-                if self.dummy_file is not None:
-                    self.dummy_fd.write(line + "\n")
+                count_brackets += line.count("(")
+                count_brackets -= line.count(")")
+                stmt.append(line)
 
-            count_brackets += line.count("(")
-            count_brackets -= line.count(")")
-            stmt.append(line)
+                if self.debug_print:
+                    print("< %s" % line)
+                if count_brackets == 0:
+                    break
 
+            stmt = "\n".join(stmt)
+
+        else:
+            if self.portfolio is not None:
+                stmt = self.portfolio_read()
+            else:
+                stmt = self.p_read()
+            if self.dummy_file is not None:
+                self.dummy_fd.write(stmt + "\n")
             if self.debug_print:
-                print("< %s" % line)
-            if count_brackets == 0:
-                break
-            if self.solver != "dummy" and self.p.poll():
-                print("%s Solver terminated unexpectedly: %s" % (self.timestamp(), "".join(stmt)), flush=True)
+                print("< %s" % stmt)
+            if stmt.count("(") != stmt.count(")"):
+                print("%s Solver terminated unexpectedly: %s" % (self.timestamp(), stmt), flush=True)
                 sys.exit(1)
 
-        stmt = "".join(stmt)
+        self.p_bytes_read += len(stmt) + 1
+
+        if self.cache_query is not None:
+            self.cache_entry["answers"][self.cache_query] = stmt
+            self.cache_entry["dirty"] = True
+            self.cache_query = None
+
         if stmt.startswith("(error"):
             print("%s Solver Error: %s" % (self.timestamp(), stmt), flush=True)
-            if self.solver != "dummy":
+            if self.p is not None:
                 self.p_close()
             sys.exit(1)
 
         return stmt
 
-    def check_sat(self, expected=["sat", "unsat", "unknown", "timeout", "interrupted"]):
-        if self.debug_print:
-            print("> (check-sat)")
-        if self.debug_file and not self.nocomments:
-            print("; running check-sat..", file=self.debug_file)
-            self.debug_file.flush()
+    def p_replay(self):
+        for i, cache_ctx in enumerate(self.smt2cache):
+            if i != 0:
+                self.p_write("(push 1)\n", False)
+            for cache_stmt in cache_ctx:
+                self.p_write(cache_stmt + "\n", False)
+
+    def timeout_restart(self):
+        # bring the session back up after a timeout killed the solver
+        self.timeout_killed = False
+        self.p_open()
+        self.p_replay()
+
+    def timeout_poll(self, timeout=0.1):
+        remaining = self.timeout_deadline - time()
+        if remaining <= 0:
+            return False
+        return self.p_poll(min(timeout, remaining))
 
-        if self.solver != "dummy":
-            if self.noincr:
-                if self.p is not None:
-                    self.p_close()
-                self.p_open()
-                for cache_ctx in self.smt2cache:
-                    for cache_stmt in cache_ctx:
-                        self.p_write(cache_stmt + "\n", False)
+    def check_sat_start(self):
+        if self.portfolio is not None:
+            self.portfolio_check_sat_start()
+            return
+
+        if self.noincr:
+            if self.p is not None:
+                self.p_close()
+            self.warm_open()
+        elif self.timeout_killed:
+            self.timeout_restart()
+
+        self.p_write(self.check_sat_cmd + "\n", True)
 
-            self.p_write("(check-sat)\n", True)
+        # prime the solver processes for the next checks while this one runs
+        if self.noincr:
+            while len(self.warm_pool) < self.warm_pool_size:
+                self.warm_spawn()
+
+    def check_sat_solve(self):
+        if self.solver != "dummy":
+            self.check_sat_start()
+            poll = self.p_poll if self.portfolio is None else self.portfolio_poll
+            if self.timeout_kill and self.portfolio is None:
+                self.timeout_deadline = time() + self.timeout
+                poll = self.timeout_poll
+            elif self.timeout != 0 and self.portfolio is not None:
+                # not all members may have a time limit of their own
+                self.timeout_deadline = time() + self.timeout
 
             if self.timeinfo:
                 i = 0
@@ -697,7 +2183,7 @@ class SmtIo:
 
                 count = 0
                 num_bs = 0
-                while self.p_poll():
+                while poll():
                     count += 1
 
                     if count < 25:
@@ -728,7 +2214,7 @@ class SmtIo:
 
             else:
                 count = 0
-                while self.p_poll(60):
+                while poll(60):
                     count += 1
                     msg = None
 
@@ -747,6 +2233,19 @@ class SmtIo:
                     if msg is not None:
                         print("%s waiting for solver (%s)" % (self.timestamp(), msg), flush=True)
 
+            if self.timeout_deadline is not None:
+                self.timeout_deadline = None
+                if self.portfolio is None and self.p_poll(0):
+                    # out of time and the solver can't tell us by itself, the
+                    # next write or check-sat brings up a fresh one
+                    self.p_kill(signal.SIGKILL)
+                    self.timeout_killed = not self.noincr
+                    if self.dummy_file is not None:
+                        self.dummy_fd.write("timeout\n")
+                    if self.debug_print:
+                        print("< timeout")
+                    return "timeout"
+
         if self.forall:
             result = self.read()
             while result not in ["sat", "unsat", "unknown", "timeout", "interrupted", ""]:
@@ -755,53 +2254,88 @@ class SmtIo:
         else:
             result = self.read()
 
+        return result
+
+    def check_sat_set_cmd(self, assume):
+        if assume:
+            self.check_sat_cmd = "(check-sat-assuming (%s))" % " ".join(assume)
+        else:
+            self.check_sat_cmd = "(check-sat)"
+
+    def check_sat(self, expected=["sat", "unsat", "unknown", "timeout", "interrupted"], assume=None):
+        stats_start = self.stats_start()
+        self.check_sat_set_cmd(assume)
+
+        if self.debug_print:
+            print("> %s" % self.check_sat_cmd)
+        if self.debug_file and not self.nocomments:
+            print("; running check-sat..", file=self.debug_file)
+            self.debug_file.flush()
+
+        result = None
+        if self.cache_dir is not None:
+            result = self.cache_lookup()
+
+        if result is None:
+            result = self.check_sat_solve()
+            if self.cache_dir is not None:
+                self.cache_store(result)
+
         if self.debug_file:
             print("(set-info :status %s)" % result, file=self.debug_file)
-            print("(check-sat)", file=self.debug_file)
+            print(self.check_sat_cmd, file=self.debug_file)
             self.debug_file.flush()
 
+        # a new model, also when the result comes from the cache
+        self.modeleval_sat = result == "sat"
+        self.modeleval_model = None
+
         if result not in expected:
             if result == "":
                 print("%s Unexpected EOF response from solver." % (self.timestamp()), flush=True)
             else:
                 print("%s Unexpected response from solver: %s" % (self.timestamp(), result), flush=True)
-            if self.solver != "dummy":
+            if self.p is not None:
                 self.p_close()
             sys.exit(1)
 
+        self.stats_end("check-sat", stats_start, result=result)
         return result
 
     def parse(self, stmt):
-        def worker(stmt):
-            if stmt[0] == '(':
-                expr = []
-                cursor = 1
-                while stmt[cursor] != ')':
-                    el, le = worker(stmt[cursor:])
-                    expr.append(el)
-                    cursor += le
-                return expr, cursor+1
-
-            if stmt[0] == '|':
-                expr = "|"
-                cursor = 1
-                while stmt[cursor] != '|':
-                    expr += stmt[cursor]
-                    cursor += 1
-                expr += "|"
-                return expr, cursor+1
-
-            if stmt[0] in [" ", "\t", "\r", "\n"]:
-                el, le = worker(stmt[1:])
-                return el, le+1
-
-            expr = ""
-            cursor = 0
-            while stmt[cursor] not in ["(", ")", "|", " ", "\t", "\r", "\n"]:
-                expr += stmt[cursor]
-                cursor += 1
-            return expr, cursor
-        return worker(stmt)[0]
+        stack = list()
+        for token in smt2_token_regex.findall(stmt):
+            if token == "(":
+                stack.append(list())
+            elif token == ")":
+                expr = stack.pop()
+                if len(stack) == 0:
+                    return expr
+                stack[-1].append(expr)
+            elif len(stack) == 0:
+                return token
+            else:
+                stack[-1].append(token)
+        assert False
+
+    def parse_header(self, stmt, n):
+        # parse the first n elements of the list in stmt, return them and
+        # the unparsed text of the remaining elements
+        stack = list()
+        for match in smt2_token_regex.finditer(stmt):
+            token = match.group()
+            if token == "(":
+                stack.append(list())
+            elif token == ")":
+                expr = stack.pop()
+                if len(stack) == 0:
+                    return expr, ""
+                stack[-1].append(expr)
+            else:
+                stack[-1].append(token)
+            if len(stack) == 1 and len(stack[0]) == n:
+                return stack[0], stmt[match.end():stmt.rindex(")")].strip()
+        assert False
 
     def unparse(self, stmt):
         if isinstance(stmt, list):
@@ -809,47 +2343,163 @@ class SmtIo:
         return stmt
 
     def bv2hex(self, v):
-        h = ""
+        if type(v) is list and len(v) == 3 and v[0] == "_" and v[1].startswith("bv"):
+            x, n = int(v[1][2:]), int(v[2])
+            return format(x, "0%dx" % ((n + 3) // 4))
+        if type(v) is str and v.startswith("#x"):
+            return v[2:].lower()
         v = self.bv2bin(v)
-        while len(v) > 0:
-            d = 0
-            if len(v) > 0 and v[-1] == "1": d += 1
-            if len(v) > 1 and v[-2] == "1": d += 2
-            if len(v) > 2 and v[-3] == "1": d += 4
-            if len(v) > 3 and v[-4] == "1": d += 8
-            h = hex(d)[2:] + h
-            if len(v) < 4: break
-            v = v[:-4]
-        return h
+        if v == "":
+            return ""
+        return format(int(v, 2), "0%dx" % ((len(v) + 3) // 4))
 
     def bv2bin(self, v):
         if type(v) is list and len(v) == 3 and v[0] == "_" and v[1].startswith("bv"):
             x, n = int(v[1][2:]), int(v[2])
-            return "".join("1" if (x & (1 << i)) else "0" for i in range(n-1, -1, -1))
+            return format(x, "0%db" % n)
         if v == "true": return "1"
         if v == "false": return "0"
         if v.startswith("#b"):
             return v[2:]
+        if v == "#x":
+            return ""
         if v.startswith("#x"):
-            return "".join(hex_dict.get(x) for x in v[2:])
+            return format(int(v[2:], 16), "0%db" % (4 * (len(v) - 2)))
         assert False
 
     def bv2int(self, v):
-        return int(self.bv2bin(v), 2)
+        if type(v) is list and len(v) == 3 and v[0] == "_" and v[1].startswith("bv"):
+            return int(v[1][2:])
+        if v == "true": return 1
+        if v == "false": return 0
+        if v.startswith("#b"):
+            return int(v[2:] or "0", 2)
+        if v.startswith("#x"):
+            return int(v[2:] or "0", 16)
+        assert False
+
+    # The list versions convert all #x (or #b) values of a get_list()
+    # result with a single int() and format() on the concatenated digits
+    # and then cut the result apart again. Zero-width values have no
+    # digits and come out as "".
+
+    def bv2bin_list(self, values):
+        digits = [v[2:] for v in values if type(v) is str and v.startswith("#x")]
+        if len(digits) < 2:
+            return [self.bv2bin(v) for v in values]
+
+        digits = "".join(digits)
+        bits = format(int(digits or "0", 16), "0%db" % (4 * len(digits)))
+        result = list()
+        pos = 0
+        for v in values:
+            if type(v) is str and v.startswith("#x"):
+                n = 4 * (len(v) - 2)
+                result.append(bits[pos:pos+n])
+                pos += n
+            else:
+                result.append(self.bv2bin(v))
+        return result
+
+    def bv2hex_list(self, values):
+        bits = ["0" * (-(len(v) - 2) % 4) + v[2:] for v in values if type(v) is str and v.startswith("#b")]
+        if len(bits) < 2:
+            return [self.bv2hex(v) for v in values]
+
+        bits = "".join(bits)
+        digits = format(int(bits or "0", 2), "0%dx" % (len(bits) // 4))
+        result = list()
+        pos = 0
+        for v in values:
+            if type(v) is str and v.startswith("#b"):
+                n = (len(v) + 1) // 4
+                result.append(digits[pos:pos+n])
+                pos += n
+            else:
+                result.append(self.bv2hex(v))
+        return result
+
+    def bv2int_list(self, values):
+        return [self.bv2int(v) for v in values]
+
+    def modeleval_record(self, stmt):
+        # Keep the text of all (define-fun ...) statements, the model only
+        # contains the interpretation of declared functions.
+        if not stmt.startswith("(get-"):
+            self.modeleval_sat = False
+            self.modeleval_model = None
+
+        if self.modeleval_buffer == "" and not stmt.startswith("(define-fun"):
+            return
+
+        stmt = self.modeleval_buffer + re.sub(r" *;.*", "", stmt)
+        self.modeleval_buffer = ""
+
+        s = re.sub(r"\|[^|]*\|", "", stmt)
+        if s.count("(") != s.count(")"):
+            self.modeleval_buffer = stmt + " "
+            return
+
+        tokens = smt2_token_regex.finditer(stmt)
+        next(tokens), next(tokens)
+        name = next(tokens).group()
+        if name.startswith("|") and name.endswith("|"):
+            name = name[1:-1]
+        self.modeleval_defs[name] = stmt
+
+    def modeleval_list(self, expr_list):
+        if not self.modeleval_sat:
+            return [None] * len(expr_list)
+
+        if self.modeleval_model is None:
+            self.write("(get-model)")
+            model = self.read()
+            model = re.sub(r"(\|[^|]*\|)|;[^\n]*", lambda m: m.group(1) or "", model)
+            self.modeleval_model = SmtModel(self.parse(model), self.modeleval_defs, self.parse)
+
+        values = list()
+        for expr in expr_list:
+            try:
+                values.append(self.modeleval_model.format(self.modeleval_model.eval(self.parse(expr))))
+            except SmtModelError:
+                values.append(None)
+        return values
 
     def get(self, expr):
+        if self.modeleval:
+            return self.get_list([expr])[0]
+        stats_start = self.stats_start()
         self.write("(get-value (%s))" % (expr))
-        return self.parse(self.read())[0][1]
+        value = self.parse(self.read())[0][1]
+        self.stats_end("get-value", stats_start, values=1)
+        return value
 
     def get_list(self, expr_list):
         if len(expr_list) == 0:
             return []
-        self.write("(get-value (%s))" % " ".join(expr_list))
-        return [n[1] for n in self.parse(self.read())]
+        stats_start = self.stats_start()
+        if self.modeleval:
+            values = self.modeleval_list(expr_list)
+            missing = [expr for expr, value in zip(expr_list, values) if value is None]
+            if len(missing) != 0:
+                self.write("(get-value (%s))" % " ".join(missing))
+                fetched = iter([n[1] for n in self.parse(self.read())])
+                values = [next(fetched) if value is None else value for value in values]
+        else:
+            self.write("(get-value (%s))" % " ".join(expr_list))
+            values = [n[1] for n in self.parse(self.read())]
+        self.stats_end("get-value", stats_start, values=len(expr_list))
+        return values
 
     def get_path(self, mod, path):
         assert mod in self.modinfo
-        path = path.replace("\\", "/").split(".")
+        path = path.replace("\\", "/")
+
+        found = self.hierindex(mod).paths.get(path)
+        if found is not None:
+            return list(found)
+
+        path = path.split(".")
 
         for i in range(len(path)-1):
             first = ".".join(path[0:i+1])
@@ -862,83 +2512,31 @@ class SmtIo:
         return [".".join(path)]
 
     def net_expr(self, mod, base, path):
-        if len(path) == 0:
-            return base
-
-        if len(path) == 1:
-            assert mod in self.modinfo
-            if path[0] == "":
-                return base
-            if path[0] in self.modinfo[mod].cells:
-                return "(|%s_h %s| %s)" % (mod, path[0], base)
-            if path[0] in self.modinfo[mod].wsize:
-                return "(|%s_n %s| %s)" % (mod, path[0], base)
-            if path[0] in self.modinfo[mod].memories:
-                return "(|%s_m %s| %s)" % (mod, path[0], base)
-            assert 0
-
-        assert mod in self.modinfo
-        assert path[0] in self.modinfo[mod].cells
-
-        nextmod = self.modinfo[mod].cells[path[0]]
-        nextbase = "(|%s_h %s| %s)" % (mod, path[0], base)
-        return self.net_expr(nextmod, nextbase, path[1:])
+        path = tuple(path)
+        if len(path) != 0 and path[-1] == "":
+            path = path[:-1]
+        prefix, suffix = self.hierindex(mod).exprs[path]
+        return prefix + base + suffix
 
     def net_width(self, mod, net_path):
-        for i in range(len(net_path)-1):
-            assert mod in self.modinfo
-            assert net_path[i] in self.modinfo[mod].cells
-            mod = self.modinfo[mod].cells[net_path[i]]
-
-        assert mod in self.modinfo
-        assert net_path[-1] in self.modinfo[mod].wsize
-        return self.modinfo[mod].wsize[net_path[-1]]
+        return self.hierindex(mod).nets[tuple(net_path)][2]
 
     def net_clock(self, mod, net_path):
-        for i in range(len(net_path)-1):
-            assert mod in self.modinfo
-            assert net_path[i] in self.modinfo[mod].cells
-            mod = self.modinfo[mod].cells[net_path[i]]
-
-        assert mod in self.modinfo
-        if net_path[-1] not in self.modinfo[mod].clocks:
-            return None
-        return self.modinfo[mod].clocks[net_path[-1]]
+        return self.hierindex(mod).nets[tuple(net_path)][3]
 
     def net_exists(self, mod, net_path):
-        for i in range(len(net_path)-1):
-            if mod not in self.modinfo: return False
-            if net_path[i] not in self.modinfo[mod].cells: return False
-            mod = self.modinfo[mod].cells[net_path[i]]
-
         if mod not in self.modinfo: return False
-        if net_path[-1] not in self.modinfo[mod].wsize: return False
-        return True
+        return tuple(net_path) in self.hierindex(mod).nets
 
     def mem_exists(self, mod, mem_path):
-        for i in range(len(mem_path)-1):
-            if mod not in self.modinfo: return False
-            if mem_path[i] not in self.modinfo[mod].cells: return False
-            mod = self.modinfo[mod].cells[mem_path[i]]
-
         if mod not in self.modinfo: return False
-        if mem_path[-1] not in self.modinfo[mod].memories: return False
-        return True
+        return tuple(mem_path) in self.hierindex(mod).mems
 
     def mem_expr(self, mod, base, path, port=None, infomode=False):
-        if len(path) == 1:
-            assert mod in self.modinfo
-            assert path[0] in self.modinfo[mod].memories
-            if infomode:
-                return self.modinfo[mod].memories[path[0]]
-            return "(|%s_m%s %s| %s)" % (mod, "" if port is None else ":%s" % port, path[0], base)
-
-        assert mod in self.modinfo
-        assert path[0] in self.modinfo[mod].cells
-
-        nextmod = self.modinfo[mod].cells[path[0]]
-        nextbase = "(|%s_h %s| %s)" % (mod, path[0], base)
-        return self.mem_expr(nextmod, nextbase, path[1:], port=port, infomode=infomode)
+        memmod, memname, prefix, suffix, meminfo = self.hierindex(mod).mems[tuple(path)]
+        if infomode:
+            return meminfo
+        return "(|%s_m%s %s| %s%s%s)" % (memmod, "" if port is None else ":%s" % port, memname, prefix, base, suffix)
 
     def mem_info(self, mod, path):
         return self.mem_expr(mod, "", path, infomode=True)
@@ -953,24 +2551,244 @@ class SmtIo:
         return self.bv2hex(self.get_net(mod_name, net_path, state_name))
 
     def get_net_hex_list(self, mod_name, net_path_list, state_name):
-        return [self.bv2hex(v) for v in self.get_net_list(mod_name, net_path_list, state_name)]
+        return self.bv2hex_list(self.get_net_list(mod_name, net_path_list, state_name))
 
     def get_net_bin(self, mod_name, net_path, state_name):
         return self.bv2bin(self.get_net(mod_name, net_path, state_name))
 
     def get_net_bin_list(self, mod_name, net_path_list, state_name):
-        return [self.bv2bin(v) for v in self.get_net_list(mod_name, net_path_list, state_name)]
+        return self.bv2bin_list(self.get_net_list(mod_name, net_path_list, state_name))
 
     def wait(self):
+        if self.cache_dir is not None:
+            self.cache_finish()
+            self.cache_evict(self.cache_dir, self.cache_size)
+        self.warm_close()
+        if self.portfolio is not None:
+            for m in self.portfolio:
+                if m.portfolio_pending and m.p is not None:
+                    m.warm_close()
+                    m.p_kill()
+                else:
+                    m.wait()
         if self.p is not None:
             self.p.wait()
             self.p_close()
 
 
+class SmtIoDrain:
+    # Returned by AsyncSmtIo.write(). Awaiting it sends the buffered
+    # statements to the solver. Internal callers of write() that don't
+    # await it just leave the statements in the buffer.
+
+    def __init__(self, smt):
+        self.smt = smt
+
+    def __await__(self):
+        return self.smt.p_drain().__await__()
+
+
+class AsyncSmtIo(SmtIo):
+    # SmtIo for asyncio: write(), check_sat(), get() and get_list() must
+    # be awaited. Solvers run as asyncio subprocesses, so a single event
+    # loop can drive many of them without threads.
+
+    def setup(self):
+        if self.solver == "dummy" or self.solver.startswith("portfolio:") or self.noincr or self.warm_pool_size != 0 or self.cache_dir is not None:
+            print("%s AsyncSmtIo does not support the dummy solver, portfolio mode, --noincr, --warm-pool or --cache." % self.timestamp(), flush=True)
+            sys.exit(1)
+        self.modeleval = False
+        SmtIo.setup(self)
+
+    def p_open(self, p=None):
+        # unless an asyncio process is passed in, the process itself is
+        # started by the first p_drain()
+        assert self.p is None
+        if p is not None:
+            self.p = p
+            running_solvers[self.p_index] = self.p
+        self.p_running = True
+        self.p_next = None
+        self.p_buffer = bytearray()
+        self.p_wbuffer = bytearray()
+        self.p_scan_pos = 0
+        self.p_scan_depth = 0
+
+    def p_write(self, data, flush):
+        data = bytes(data, "ascii")
+        self.p_bytes_written += len(data)
+        self.p_wbuffer += data
+
+    async def p_drain(self):
+        if self.p is None:
+            if not self.setup_done:
+                return
+            try:
+                self.p = await asyncio.create_subprocess_exec(*self.popen_vargs, stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=self.p_own_group())
+            except FileNotFoundError:
+                print("%s SMT Solver '%s' not found in path." % (self.timestamp(), self.popen_vargs[0]), flush=True)
+                sys.exit(1)
+            running_solvers[self.p_index] = self.p
+
+        if len(self.p_wbuffer) != 0:
+            self.p_flushes += 1
+            self.p.stdin.write(bytes(self.p_wbuffer))
+            del self.p_wbuffer[:]
+            try:
+                await self.p.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    async def p_read(self):
+        await self.p_drain()
+        while True:
+            data = self.p_extract()
+            if data is not None:
+                return data
+            if not self.p_running:
+                return ""
+            start = time()
+            data = await self.p.stdout.read(1024 * 1024)
+            self.p_blocked += time() - start
+            if len(data) == 0:
+                self.p_running = False
+            else:
+                self.p_buffer += data
+
+    def p_kill(self, sig=signal.SIGTERM):
+        # doesn't reap the process, coroutines should use p_kill_wait()
+        if self.p is not None:
+            if self.p.returncode is None:
+                try:
+                    if self.p_own_group():
+                        os.killpg(self.p.pid, sig)
+                    else:
+                        self.p.send_signal(sig)
+                except ProcessLookupError:
+                    pass
+            del running_solvers[self.p_index]
+            self.p = None
+
+    async def p_kill_wait(self, sig=signal.SIGTERM):
+        p = self.p
+        self.p_kill(sig)
+        if p is not None:
+            await p.wait()
+
+    def write(self, stmt, unroll=True, info=True):
+        SmtIo.write(self, stmt, unroll, info)
+        return SmtIoDrain(self)
+
+    async def read(self):
+        stmt = await self.p_read()
+
+        if self.dummy_file is not None:
+            self.dummy_fd.write(stmt + "\n")
+        if self.debug_print:
+            print("< %s" % stmt)
+        if stmt.count("(") != stmt.count(")"):
+            print("%s Solver terminated unexpectedly: %s" % (self.timestamp(), stmt), flush=True)
+            self.p_kill(signal.SIGKILL)
+            sys.exit(1)
+
+        self.p_bytes_read += len(stmt) + 1
+
+        if stmt.startswith("(error"):
+            print("%s Solver Error: %s" % (self.timestamp(), stmt), flush=True)
+            self.p_kill(signal.SIGKILL)
+            sys.exit(1)
+
+        return stmt
+
+    async def check_sat(self, expected=["sat", "unsat", "unknown", "timeout", "interrupted"], assume=None):
+        stats_start = self.stats_start()
+        self.check_sat_set_cmd(assume)
+
+        if self.debug_print:
+            print("> %s" % self.check_sat_cmd)
+        if self.debug_file and not self.nocomments:
+            print("; running check-sat..", file=self.debug_file)
+            self.debug_file.flush()
+
+        if self.timeout_killed:
+            self.timeout_restart()
+        self.p_write(self.check_sat_cmd + "\n", True)
+
+        if self.timeout_kill:
+            try:
+                result = await asyncio.wait_for(self.read(), self.timeout)
+            except asyncio.TimeoutError:
+                await self.p_kill_wait(signal.SIGKILL)
+                self.timeout_killed = True
+                result = "timeout"
+                if self.debug_print:
+                    print("< timeout")
+        else:
+            result = await self.read()
+        if self.forall:
+            while result not in ["sat", "unsat", "unknown", "timeout", "interrupted", ""]:
+                print("%s %s: %s" % (self.timestamp(), self.solver, result))
+                result = await self.read()
+
+        if self.debug_file:
+            print("(set-info :status %s)" % result, file=self.debug_file)
+            print(self.check_sat_cmd, file=self.debug_file)
+            self.debug_file.flush()
+
+        if result not in expected:
+            if result == "":
+                print("%s Unexpected EOF response from solver." % (self.timestamp()), flush=True)
+            else:
+                print("%s Unexpected response from solver: %s" % (self.timestamp(), result), flush=True)
+            self.p_kill(signal.SIGKILL)
+            sys.exit(1)
+
+        self.stats_end("check-sat", stats_start, result=result)
+        return result
+
+    async def get(self, expr):
+        stats_start = self.stats_start()
+        self.write("(get-value (%s))" % (expr))
+        value = self.parse(await self.read())[0][1]
+        self.stats_end("get-value", stats_start, values=1)
+        return value
+
+    async def get_list(self, expr_list):
+        if len(expr_list) == 0:
+            return []
+        stats_start = self.stats_start()
+        self.write("(get-value (%s))" % " ".join(expr_list))
+        values = [n[1] for n in self.parse(await self.read())]
+        self.stats_end("get-value", stats_start, values=len(expr_list))
+        return values
+
+    async def get_net_hex(self, mod_name, net_path, state_name):
+        return self.bv2hex(await self.get_net(mod_name, net_path, state_name))
+
+    async def get_net_hex_list(self, mod_name, net_path_list, state_name):
+        return self.bv2hex_list(await self.get_net_list(mod_name, net_path_list, state_name))
+
+    async def get_net_bin(self, mod_name, net_path, state_name):
+        return self.bv2bin(await self.get_net(mod_name, net_path, state_name))
+
+    async def get_net_bin_list(self, mod_name, net_path_list, state_name):
+        return self.bv2bin_list(await self.get_net_list(mod_name, net_path_list, state_name))
+
+    async def wait(self):
+        if self.p is not None:
+            await self.p_drain()
+            self.p.stdin.close()
+            await self.p.wait()
+            del running_solvers[self.p_index]
+            self.p = None
+
+
 class SmtOpts:
     def __init__(self):
         self.shortopts = "s:S:v"
-        self.longopts = ["unroll", "noincr", "noprogress", "timeout=", "dump-smt2=", "logic=", "dummy=", "info=", "nocomments"]
+        self.longopts = ["unroll", "noincr", "noprogress", "timeout=", "dump-smt2=", "logic=", "dummy=", "info=", "nocomments", "warm-pool=", "modeleval", "cache=", "cache-size=",
+                "prep-cache=", "prep-cache-size="]
         self.solver = "yices"
         self.solver_opts = list()
         self.debug_print = False
@@ -983,6 +2801,12 @@ class SmtOpts:
         self.logic = None
         self.info_stmts = list()
         self.nocomments = False
+        self.warm_pool_size = 0
+        self.modeleval = False
+        self.cache_dir = None
+        self.cache_size = 256
+        self.prep_cache_dir = None
+        self.prep_cache_size = 256
 
     def handle(self, o, a):
         if o == "-s":
@@ -1009,6 +2833,18 @@ class SmtOpts:
             self.info_stmts.append(a)
         elif o == "--nocomments":
             self.nocomments = True
+        elif o == "--warm-pool":
+            self.warm_pool_size = int(a)
+        elif o == "--modeleval":
+            self.modeleval = True
+        elif o == "--cache":
+            self.cache_dir = a
+        elif o == "--cache-size":
+            self.cache_size = int(a)
+        elif o == "--prep-cache":
+            self.prep_cache_dir = a
+        elif o == "--prep-cache-size":
+            self.prep_cache_size = int(a)
         else:
             return False
         return True
@@ -1019,11 +2855,23 @@ class SmtOpts:
         set SMT solver: z3, yices, boolector, bitwuzla, cvc4, mathsat, dummy
         default: yices
 
+    -s portfolio:<solver>,<solver>,...
+        run all listed solvers in parallel on the same problem and use
+        the first definitive answer for each (check-sat). Solvers that
+        are still busy with an old query when the next one is issued
+        are restarted. -S options are not passed to portfolio solvers,
+        instead each of them takes its own command line arguments after
+        the solver name, separated by spaces, e.g.
+        "portfolio:z3 smt.random_seed=1,z3 smt.random_seed=2"
+
     -S <opt>
         pass <opt> as command line argument to the solver
 
     --timeout <value>
         set the solver timeout to the specified value (in seconds).
+        solvers without a timeout option of their own (mathsat,
+        boolector, bitwuzla, abc) are killed when the time is up,
+        and so are all members of a portfolio that are still running.
 
     --logic <smt2_logic>
         use the specified SMT2 logic (e.g. QF_AUFBV)
@@ -1042,6 +2890,36 @@ class SmtOpts:
         don't use incremental solving, instead restart solver for
         each (check-sat). This also avoids (push) and (pop).
 
+    --warm-pool <n>
+        with --noincr, keep <n> solver processes running in the
+        background that already have the outer (push) contexts loaded,
+        so that each (check-sat) only needs to send the rest.
+
+    --modeleval
+        after a satisfiable (check-sat), fetch the model once using
+        (get-model) and evaluate (get-value) queries locally whenever
+        possible, instead of asking the solver for each of them.
+
+    --cache <dirname>
+        keep (check-sat) results and the following (get-value) answers
+        in the given directory, indexed by a hash of the solver command
+        line and all statements sent to the solver so far. A check that
+        is found in the cache is answered without running the solver.
+
+    --cache-size <megabytes>
+        remove the least recently used entries from the result cache
+        when it grows beyond this size. default: 256
+
+    --prep-cache <dirname>
+        keep the parsed design metadata, and with --unroll also the
+        unrolled statements, for each smt2 file in the given directory,
+        indexed by a hash of the file and of the options that change
+        them. a rerun on the same file skips parsing and unrolling.
+
+    --prep-cache-size <megabytes>
+        remove the least recently used entries from the preprocessing
+        cache when it grows beyond this size. default: 256
+
     --noprogress
         disable timer display during solving
         (this option is set implicitly on Windows)
@@ -1084,6 +2962,16 @@ class MkVcd:
         if path not in self.clocks:
             print("b%s %s" % (bits, self.nets[path][0]), file=self.f)
 
+    def set_net_list(self, path_list, bits_list):
+        assert self.t >= 0
+        lines = list()
+        for path, bits in zip(path_list, bits_list):
+            path = tuple(path)
+            assert path in self.nets
+            if path not in self.clocks:
+                lines.append("b%s %s\n" % (bits, self.nets[path][0]))
+        self.f.write("".join(lines))
+
     def escape_name(self, name):
         name = re.sub(r"\[([0-9a-zA-Z_]*[a-zA-Z_][0-9a-zA-Z_]*)\]", r"<\1>", name)
         if re.match("[\[\]]", name) and name[0] != "\\":
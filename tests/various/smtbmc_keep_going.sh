@@ -0,0 +1,48 @@
+#!/usr/bin/env bash
+# yosys-smtbmc --keep-going with --jobs must report the same failed
+# assertions and write the same traces as without --jobs. The design has
+# no inputs, so there is only one model for every failing step.
+
+set -e
+
+if ! command -v yices-smt2 > /dev/null ; then
+	echo "  yices-smt2 not found, skipping"
+	exit 0
+fi
+
+mkdir -p temp
+
+../../yosys -q -s - <<- EOY
+	read_verilog -formal << EOV
+		module top(input clk, output reg [7:0] c = 0);
+			always @(posedge clk) c <= c + 1;
+			always @* begin
+				assert (c != 3);
+				assert (c != 5);
+				assert (c[2:0] != 5);
+				assert (c != 9);
+			end
+		endmodule
+	EOV
+	prep -top top
+	write_smt2 -wires temp/smtbmc_keep_going.smt2
+EOY
+
+run() {
+	name=$1
+	shift
+	mkdir -p temp/smtbmc_keep_going_$name
+	rm -f temp/smtbmc_keep_going_$name/*
+	../../yosys-smtbmc --keep-going --dump-vcd temp/smtbmc_keep_going_$name/trace_%.vcd "$@" temp/smtbmc_keep_going.smt2 |
+		grep "Assert failed\|Writing trace\|Status" | sed 's/^## *[0-9:]* *//; s/smtbmc_keep_going_[a-z]*/DIR/' > temp/smtbmc_keep_going_$name.log || true
+}
+
+for t in 16 0:3:16; do
+	run ref -t $t
+	for jobs in 2 3; do
+		echo "  -t $t --jobs $jobs"
+		run jobs -t $t --jobs $jobs
+		cmp temp/smtbmc_keep_going_ref.log temp/smtbmc_keep_going_jobs.log
+		diff -r temp/smtbmc_keep_going_ref temp/smtbmc_keep_going_jobs
+	done
+done
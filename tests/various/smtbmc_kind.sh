@@ -0,0 +1,59 @@
+#!/usr/bin/env bash
+# yosys-smtbmc with --jobs, --kind and --check-assuming must give the same
+# status as plain BMC, also when the first steps are skipped.
+
+set -e
+
+if ! command -v yices-smt2 > /dev/null ; then
+	echo "  yices-smt2 not found, skipping"
+	exit 0
+fi
+
+mkdir -p temp
+
+for incr in 1 2; do
+	../../yosys -q -s - <<- EOY
+		read_verilog -formal << EOV
+			module top(input clk, output reg [7:0] c = 0);
+				always @(posedge clk) c <= c + $incr;
+				always @* assert (!c[0]);
+			endmodule
+		EOV
+		prep -top top
+		write_smt2 -wires temp/smtbmc_kind_$incr.smt2
+	EOY
+done
+
+# fails in steps 1 and 5, induction needs k = 4
+../../yosys -q -s - <<- EOY
+	read_verilog -formal << EOV
+		module top(input clk, output reg [2:0] c = 0);
+			always @(posedge clk) if (c != 7) c <= c + 1;
+			always @* assert (c != 1 && c != 5);
+		endmodule
+	EOV
+	prep -top top
+	write_smt2 -wires temp/smtbmc_kind_sat.smt2
+EOY
+
+check() {
+	expect=$1
+	shift
+	../../yosys-smtbmc "$@" | grep -q "Status: $expect$"
+}
+
+for opts in "" "--jobs 3" "--kind" "--kind --jobs 3" "--kind --check-assuming --jobs 2"; do
+	echo "  $opts"
+	check FAILED $opts -t 60:70 temp/smtbmc_kind_1.smt2
+	check PASSED $opts -t 60:70 temp/smtbmc_kind_2.smt2
+	check FAILED $opts -t 10 temp/smtbmc_kind_1.smt2
+	check PASSED $opts -t 10 temp/smtbmc_kind_2.smt2
+	check FAILED $opts -t 2:10 temp/smtbmc_kind_sat.smt2
+done
+
+# BMC only checks steps 2 and 3, too few for induction with k = 4
+for opts in "--kind" "--kind --jobs 3"; do
+	echo "  $opts (k = 4)"
+	check FAILED $opts -t 2:4 temp/smtbmc_kind_sat.smt2
+	check PASSED $opts -t 6:12 temp/smtbmc_kind_sat.smt2
+done
@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+# yosys-smtbmc --modeleval must not ask for the model with solvers that
+# always unroll, the model has nothing to evaluate the queries with.
+
+set -e
+
+if ! command -v boolector > /dev/null ; then
+	echo "  boolector not found, skipping"
+	exit 0
+fi
+
+mkdir -p temp
+
+../../yosys -q -s - <<- EOY
+	read_verilog -formal << EOV
+		module top(input clk, input [7:0] a, output reg [7:0] c = 0);
+			always @(posedge clk) c <= c + a;
+			always @* assert (c != 42);
+		endmodule
+	EOV
+	prep -top top
+	write_smt2 -wires temp/smtbmc_modeleval.smt2
+EOY
+
+rm -f temp/smtbmc_modeleval_input.smt2
+../../yosys-smtbmc -s boolector --modeleval -t 5 --dump-vcd temp/smtbmc_modeleval.vcd \
+	--dump-smt2 temp/smtbmc_modeleval_input.smt2 temp/smtbmc_modeleval.smt2 | grep -q "Status: FAILED$"
+grep -q "get-value" temp/smtbmc_modeleval_input.smt2
+if grep -q "get-model" temp/smtbmc_modeleval_input.smt2; then
+	echo "(get-model) sent to an unrolling solver"
+	exit 1
+fi
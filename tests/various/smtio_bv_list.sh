@@ -0,0 +1,34 @@
+#!/usr/bin/env bash
+# the list versions of the bit-vector conversions in smtio.py must give
+# the same results as converting each value on its own, including for
+# zero-width values.
+
+set -e
+
+python3 - << 'EOT'
+import sys
+sys.path.insert(0, "../../backends/smt2")
+from smtio import SmtIo
+
+smt = SmtIo()
+
+values = ["#b", "#x", "#b0", "#b1011", "#b000101101", "#x", "#x0", "#x3f", "#xdeadBEEF",
+          "true", "false", ["_", "bv5", "3"], "#b", "#x00"]
+
+for helper in ["bv2bin", "bv2hex", "bv2int"]:
+    single = [getattr(smt, helper)(v) for v in values]
+    assert getattr(smt, helper + "_list")(values) == single, helper
+    for v, r in zip(values, single):
+        assert getattr(smt, helper + "_list")([v, v]) == [r, r], (helper, v)
+
+for v in ["#b", "#x"]:
+    assert smt.bv2bin(v) == "", v
+    assert smt.bv2hex(v) == "", v
+    assert smt.bv2int(v) == 0, v
+    assert smt.bv2bin_list([v, v]) == ["", ""], v
+    assert smt.bv2hex_list([v, v]) == ["", ""], v
+    assert smt.bv2int_list([v, v]) == [0, 0], v
+
+assert smt.bv2bin_list(["#x1", "#x", "#xf"]) == ["0001", "", "1111"]
+assert smt.bv2hex_list(["#b1", "#b", "#b10000"]) == ["1", "", "10"]
+EOT
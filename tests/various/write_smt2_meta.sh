@@ -0,0 +1,71 @@
+#!/usr/bin/env bash
+# write_smt2 -meta must write valid JSON with the same metadata as the
+# "; yosys-smt2-*" comments in the smt2 file, as read by yosys-smtbmc.
+
+set -e
+mkdir -p temp
+
+../../yosys -q -s - <<- 'EOY'
+	read_verilog -formal << EOV
+		module sub(input clk, input [3:0] a, output reg [3:0] q);
+			reg [3:0] mem [0:3];
+			always @(posedge clk) begin
+				mem[a[1:0]] <= a;
+				q <= mem[a[3:2]];
+			end
+			always @* cover (q == 4'd5);
+		endmodule
+
+		module top(input clk, input [3:0] \in"put\ , output [3:0] q);
+			(* anyconst *) reg [3:0] k;
+			sub s0 (.clk(clk), .a(\in"put\  ^ k), .q(q));
+			always @* assume (\in"put\  != 0);
+			always @* assert (q != 4'd15);
+		endmodule
+	EOV
+	prep -top top
+	write_rtlil temp/write_smt2_meta.il
+EOY
+
+check_meta() {
+	python3 - temp/write_smt2_meta.smt2 temp/write_smt2_meta.json << 'EOT'
+import sys
+sys.path.insert(0, "../../backends/smt2")
+from smtio import SmtIo, SmtModInfo
+
+text = SmtIo()
+with open(sys.argv[1]) as f:
+    for line in f:
+        if line.startswith("; yosys-smt2-"):
+            text.info(line.rstrip("\n"))
+
+meta = SmtIo()
+meta.load_meta(sys.argv[2], sys.argv[1])
+
+for attr in ["topmod", "smt2_options", "logic_qf", "logic_ax", "logic_bv", "logic_dt", "forall"]:
+    assert getattr(text, attr) == getattr(meta, attr), attr
+assert sorted(text.modinfo) == sorted(meta.modinfo)
+for name in text.modinfo:
+    for attr in list(SmtModInfo.net_views) + ["wsize"] + list(SmtModInfo.containers):
+        assert getattr(text.modinfo[name], attr) == getattr(meta.modinfo[name], attr), (name, attr)
+EOT
+}
+
+for opts in "" "-wires" "-wires -stbv" "-wires -stdt"; do
+	echo "  $opts"
+	rm -f temp/write_smt2_meta.smt2 temp/write_smt2_meta.json
+	../../yosys -q -p "read_rtlil temp/write_smt2_meta.il; write_smt2 $opts -meta temp/write_smt2_meta.json temp/write_smt2_meta.smt2"
+	check_meta
+done
+
+# a sidecar from another write_smt2 call must be rejected
+../../yosys -q -p "read_rtlil temp/write_smt2_meta.il; write_smt2 -wires temp/write_smt2_meta.smt2"
+if check_meta > /dev/null; then
+	echo "stale metadata file was accepted"
+	exit 1
+fi
+
+# names that aren't valid UTF-8 must still give valid JSON
+printf 'module top(input clk, output reg \\q\xe9 = 0);\n\talways @(posedge clk) \\q\xe9  <= !\\q\xe9 ;\nendmodule\n' > temp/write_smt2_meta_latin1.v
+../../yosys -q -p "read_verilog temp/write_smt2_meta_latin1.v; prep; write_smt2 -wires -meta temp/write_smt2_meta_latin1.json temp/write_smt2_meta_latin1.smt2"
+python3 -c 'import json, sys; assert "q\xe9" in json.load(open(sys.argv[1]))["modules"][0]["wires"]' temp/write_smt2_meta_latin1.json